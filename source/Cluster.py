@@ -123,27 +123,28 @@ class Cluster:
 
             return self
 
-    def cluster_error(self, data_table):
+    def cluster_error(self, data_table, fips_to_line = None):
         """
-        Input: data_table
+        Input: data_table, and optionally its table from ID to line index
+        (e.g. PointIndex.fips_to_line()) to share between calls
         
         Output: The error as the sum of the square of the distance from each point
         in the cluster to the cluster center (weighted by its population)
         """
         # Build hash table to accelerate error computation
-        fips_to_line = {}
-        for line_idx in range(len(data_table)):
-            line = data_table[line_idx]
-            fips_to_line[line[0]] = line_idx
+        if fips_to_line is None:
+            fips_to_line = {}
+            for line_idx in range(len(data_table)):
+                line = data_table[line_idx]
+                fips_to_line[line[0]] = line_idx
         
         # compute error as weighted squared distance from counties to cluster center
         total_error = 0
         counties = self.fips_codes()
         for county in counties:
             line = data_table[fips_to_line[county]]
-            singleton_cluster = Cluster(set([line[0]]), line[1], line[2], line[3], line[4])
-            singleton_distance = self.distance(singleton_cluster)
-            total_error += (singleton_distance ** 2) * singleton_cluster.total_population()
+            singleton_distance = abs(self._vert_center - line[2]) + abs(self._horiz_center - line[1])
+            total_error += (singleton_distance ** 2) * line[3]
         return total_error
             
         
@@ -0,0 +1,164 @@
+"""
+Clustering class: a clustering of a list of points stored as one integer
+label per point plus per-cluster arrays of weights, centers and corners.
+Cluster objects and sets of ID's are only built when asked for.
+"""
+
+import numpy as np
+from Cluster import Cluster
+from clustering_numpy import group_centers, group_corners, group_weights
+
+
+class Clustering:
+    """
+    Label-array representation of a clustering
+    """
+
+    __slots__ = ('_ids', '_xs', '_ys', '_ws', '_cxs', '_cys', '_labels',
+                 '_centers', '_weights', '_corners', '_order', '_bounds')
+
+    def __init__(self, ids, arrays, labels, centers, weights, corners):
+        """
+        Create a clustering. ids[i] is an iterable of the ID's of point i,
+        arrays are the points' (xs, ys, ws, cxs, cys), labels[i] is the
+        cluster of point i or -1 if it belongs to none; centers and corners
+        are (k, 2) arrays and weights holds the clusters' total weights.
+        """
+        self._ids = ids
+        self._xs, self._ys, self._ws, self._cxs, self._cys = arrays
+        self._labels = np.asarray(labels, dtype=np.intp)
+        self._centers = np.asarray(centers, dtype=float).reshape(-1, 2)
+        self._weights = np.asarray(weights)
+        self._corners = np.asarray(corners, dtype=float).reshape(-1, 2)
+        self._order = None
+        self._bounds = None
+
+    @classmethod
+    def from_labels(cls, ids, arrays, labels, num_clusters):
+        """
+        Create a clustering from the points' labels alone, computing the
+        weighted centers and the corners of the clusters. Empty clusters
+        get center (0, 0), weight 0 and corner (0, 0).
+        """
+        xs, ys, ws, cxs, cys = arrays
+        labels = np.asarray(labels, dtype=np.intp)
+        member = labels >= 0
+        grouped = labels[member]
+        centers = group_centers(grouped, xs[member], ys[member], ws[member],
+                                num_clusters, np.zeros((num_clusters, 2)))
+        weights = group_weights(grouped, ws[member], num_clusters)
+        corners = group_corners(grouped, cxs[member], cys[member], num_clusters)
+
+        return cls(ids, arrays, labels, centers, weights, corners)
+
+    @classmethod
+    def from_clusters(cls, data_table, cluster_list):
+        """
+        Label the points of a data table (rows of ID, x, y, weight, ...)
+        with the index of the Cluster in cluster_list holding them. The
+        clusters keep their own centers, weights and corners.
+        """
+        fips_to_line = {}
+        for line_idx in range(len(data_table)):
+            fips_to_line[data_table[line_idx][0]] = line_idx
+        labels = np.full(len(data_table), -1, dtype=np.intp)
+        for cluster_idx in range(len(cluster_list)):
+            for fips_code in cluster_list[cluster_idx].fips_codes():
+                labels[fips_to_line[fips_code]] = cluster_idx
+
+        xs = np.array([line[1] for line in data_table], dtype=float)
+        ys = np.array([line[2] for line in data_table], dtype=float)
+        ws = np.array([line[3] for line in data_table])
+        ids = [[line[0]] for line in data_table]
+        centers = [(cluster.horiz_center(), cluster.vert_center()) for cluster in cluster_list]
+        weights = [cluster.total_population() for cluster in cluster_list]
+        corners = [cluster.corner() for cluster in cluster_list]
+
+        return cls(ids, (xs, ys, ws, xs, ys), labels, centers, weights, corners)
+
+    def __len__(self):
+        """
+        Number of clusters
+        """
+        return len(self._centers)
+
+    def __repr__(self):
+        """
+        String representation
+        """
+        return "Clustering(%d points, %d clusters)" % (len(self._labels), len(self))
+
+    def labels(self):
+        """
+        Get the array of point labels (-1 for unclustered points)
+        """
+        return self._labels
+
+    def arrays(self):
+        """
+        Get the points' (xs, ys, ws, cxs, cys) arrays
+        """
+        return self._xs, self._ys, self._ws, self._cxs, self._cys
+
+    def centers(self):
+        """
+        Get the (k, 2) array of cluster centers
+        """
+        return self._centers
+
+    def weights(self):
+        """
+        Get the array of cluster weights
+        """
+        return self._weights
+
+    def corners(self):
+        """
+        Get the (k, 2) array of upper right corners of the clusters
+        """
+        return self._corners
+
+    def count(self):
+        """
+        Number of points that belong to some cluster
+        """
+        return int(np.count_nonzero(self._labels >= 0))
+
+    def members(self, idx):
+        """
+        Get the array of indices of the points in cluster idx
+        """
+        if self._order is None:
+            self._order = np.argsort(self._labels, kind='stable')
+            self._bounds = np.searchsorted(self._labels[self._order],
+                                           np.arange(len(self) + 1))
+        return self._order[self._bounds[idx]:self._bounds[idx + 1]]
+
+    def fips_codes(self, idx):
+        """
+        Build the set of ID's of cluster idx
+        """
+        return set().union(*[self._ids[point] for point in self.members(idx).tolist()])
+
+    def costs(self):
+        """
+        Array of cluster costs, || corner ||*total weight
+        """
+        return self._weights * self._corners.sum(axis=1)
+
+    def cost(self):
+        """
+        Total cost of the clustering
+        """
+        return float(self.costs().sum())
+
+    def to_clusters(self):
+        """
+        Build the list of Cluster objects of the clustering
+        """
+        centers = self._centers.tolist()
+        weights = self._weights.tolist()
+        corners = self._corners.tolist()
+        return [Cluster(self.fips_codes(idx), centers[idx][0], centers[idx][1],
+                        weights[idx], tuple(corners[idx]))
+                for idx in range(len(self))]
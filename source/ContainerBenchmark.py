@@ -0,0 +1,278 @@
+"""
+Benchmark harness for the CSP solvers.
+
+Runs k-means, hierarchical clustering, closest corner reassignment, the
+exact branch and bound search and the PTAS preprocessing over the shipped
+data sets and over synthetic data sets of growing size. For every run it
+records wall time, peak memory, distance evaluations (or search nodes)
+and the cost to lower bound ratio, writes them as JSON and, given a
+baseline file from an earlier run, flags the runs that got slower, used
+more memory or found worse solutions.
+"""
+
+from Cluster import Cluster
+from exact_search import branchAndBound
+from ContainerKmeans import readFile
+from ContainerPTAS import candidateArray, candidateCorners, rayCounts
+from clustering_algorithms import closestCorner, hierarchical_clustering, kmeans_clustering
+from clustering_numpy import kmeans_arrays, reassigned_cost
+import contextlib
+import glob
+import io
+import json
+import numpy as np
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+# largest data sets each solver is run on, by number of points
+LIMITS = {'kmeans': 100000, 'closestCorner': 100000, 'hierarchical': 20000,
+          'branchAndBound': 111, 'ptas': 3108, 'kmeans_arrays': 10 ** 7}
+
+# smallest slowdown in seconds reported as a regression, below it is timing noise
+TIME_FLOOR = 0.01
+
+# timed runs per solver when comparing with a baseline and --repeat is not given
+BASELINE_REPEAT = 5
+
+#******************************************************************************
+# Data sets
+#******************************************************************************
+
+def shippedTables(directory):
+    """ (name, data table) of the data_*.csv files, smallest first """
+
+    tables = []
+    for filename in glob.glob(os.path.join(directory, 'data_*.csv')):
+        with contextlib.redirect_stdout(io.StringIO()):
+            data = readFile(filename)
+        tables.append((os.path.basename(filename), data))
+
+    return sorted(tables, key = lambda table: len(table[1]))
+
+
+def syntheticTable(n, seed = 0):
+    """
+    Data table of n points: 80% around 20 gaussian "metro areas" and 20%
+    uniform over a 1000 x 1000 square, with log-normal integer weights
+    """
+
+    rng = np.random.default_rng(seed)
+    metros = rng.uniform(100, 900, size = (20, 2))
+    clustered = int(0.8 * n)
+    points = np.vstack((metros[rng.integers(0, 20, clustered)] +
+                        rng.normal(0, 30, size = (clustered, 2)),
+                        rng.uniform(0, 1000, size = (n - clustered, 2))))
+    points = np.clip(points, 0, 1000)
+    weights = np.maximum(1, rng.lognormal(8, 1.5, n)).astype(np.int64)
+
+    return [[str(idx + 1), x, y, w, 0.0] for idx, ((x, y), w) in
+            enumerate(zip(points.tolist(), weights.tolist()))]
+
+#******************************************************************************
+# Solvers under test, each returning (cost, distance evaluations or None)
+#******************************************************************************
+
+def singletonList(data):
+    """ One single point Cluster per row of a data table """
+
+    return [Cluster(set([x[0]]), x[1], x[2], x[3], (x[1], x[2])) for x in data]
+
+
+def runKmeans(data, k, iterations):
+    """ kmeans_clustering on the singletons; cost of the k-means corners """
+
+    stats = {}
+    cluster_list = kmeans_clustering(singletonList(data), k, iterations, stats)
+    return sum([cluster.cost() for cluster in cluster_list]), stats['distance_evaluations']
+
+
+def runClosestCorner(data, k, iterations):
+    """ closestCorner to the corners of a k-means solution """
+
+    singletons = singletonList(data)
+    corners = [cluster.corner() for cluster in kmeans_clustering(singletons, k, iterations)]
+    tic = time.perf_counter()
+    cluster_list = closestCorner(singletons, corners)[0]
+    return sum([cluster.cost() for cluster in cluster_list]), None, time.perf_counter() - tic
+
+
+def runHierarchical(data, k, iterations):
+    """ hierarchical_clustering down to k clusters """
+
+    cluster_list = hierarchical_clustering(singletonList(data), k)
+    return sum([cluster.cost() for cluster in cluster_list]), None
+
+
+def runBranchAndBound(data, k, iterations):
+    """ Exact CSP optimum; evaluations are the search nodes visited """
+
+    cost, dummy_corners, nodes, dummy_pruned, dummy_expired = branchAndBound(data, candidateArray(data), k)
+    return cost, nodes
+
+
+def runPTAS(data, k, iterations):
+    """ Streamed count of the transformed potential container points on 5 rays """
+
+    rayCounts(candidateCorners(data), 5)
+    return None, None
+
+
+def runKmeansArrays(data, k, iterations):
+    """ Array k-means plus reassignment, without Cluster objects """
+
+    xs = np.array([x[1] for x in data])
+    ys = np.array([x[2] for x in data])
+    ws = np.array([x[3] for x in data])
+    stats = {}
+    corners = kmeans_arrays(xs, ys, ws, k, iterations, stats = stats)[3]
+    return reassigned_cost(xs, ys, ws, xs, ys, corners), stats['distance_evaluations']
+
+
+SOLVERS = [('kmeans', runKmeans), ('closestCorner', runClosestCorner),
+           ('hierarchical', runHierarchical), ('branchAndBound', runBranchAndBound),
+           ('ptas', runPTAS), ('kmeans_arrays', runKmeansArrays)]
+
+#******************************************************************************
+# Measurement and baseline comparison
+#******************************************************************************
+
+def measure(solver, data, k, iterations, repeat, memory):
+    """
+    Best wall time of repeat runs, then one traced run for the peak memory.
+    A solver may return its own time as a third value to leave its setup
+    out of the measurement.
+    """
+
+    seconds = float('inf')
+    for dummy_run in range(repeat):
+        tic = time.perf_counter()
+        result = solver(data, k, iterations)
+        elapsed = time.perf_counter() - tic
+        seconds = min(seconds, result[2] if len(result) > 2 else elapsed)
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        solver(data, k, iterations)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return result[0], result[1], seconds, peak
+
+
+def runSuite(tables, solvers, k, iterations, repeat, memory):
+    """ Measure every solver on every table it is allowed to run on """
+
+    results = []
+    for name, data in tables:
+        lower_bound = sum([x[3]*(x[1] + x[2]) for x in data])
+        for solver_name, solver in SOLVERS:
+            if solver_name not in solvers or len(data) > LIMITS[solver_name] or len(data) < k:
+                continue
+            cost, evaluations, seconds, peak = measure(solver, data, k, iterations, repeat, memory)
+            results.append({'dataset': name, 'n': len(data), 'solver': solver_name, 'k': k,
+                            'seconds': seconds, 'peak_bytes': peak,
+                            'distance_evaluations': evaluations, 'cost': cost,
+                            'ratio': None if cost is None else cost / lower_bound})
+            print("%-20s %8d %-15s %10.4fs %12s %12s %10s" % (
+                name, len(data), solver_name, seconds,
+                '-' if peak is None else '%.1fMB' % (peak / 2.0 ** 20),
+                '-' if evaluations is None else evaluations,
+                '-' if cost is None else '%.4f' % (cost / lower_bound)))
+            sys.stdout.flush()
+
+    return results
+
+
+def compare(results, baseline, tolerance, time_floor = TIME_FLOOR):
+    """
+    Runs that regressed against a baseline: wall time or peak memory above
+    (1 + tolerance) times the baseline's, or a higher cost ratio. Slowdowns
+    under time_floor seconds are ignored as noise
+    """
+
+    previous = dict(((run['dataset'], run['solver'], run['k']), run) for run in baseline['results'])
+    regressions = []
+    for run in results:
+        old = previous.get((run['dataset'], run['solver'], run['k']))
+        if old is None:
+            continue
+        for field in ['seconds', 'peak_bytes']:
+            if run[field] is not None and old[field] and run[field] > (1 + tolerance) * old[field]:
+                if field == 'seconds' and run[field] - old[field] < time_floor:
+                    continue
+                regressions.append((run, field, old[field], run[field]))
+        if run['ratio'] is not None and old['ratio'] is not None and run['ratio'] > old['ratio'] + 1e-9:
+            regressions.append((run, 'ratio', old['ratio'], run['ratio']))
+
+    return regressions
+
+
+def main():
+    args = parse_args()
+
+    tables = []
+    if not args.synthetic_only:
+        tables = shippedTables(args.data)
+    tables += [('synthetic_%d' % n, syntheticTable(n, args.seed)) for n in args.sizes]
+    solvers = args.solvers or [name for name, dummy_solver in SOLVERS]
+    if args.repeat is None:
+        args.repeat = BASELINE_REPEAT if args.baseline else 1
+
+    print("%-20s %8s %-15s %11s %12s %12s %10s" % ('dataset', 'n', 'solver', 'time',
+                                                   'peak memory', 'evaluations', 'ratio'))
+    results = runSuite(tables, solvers, args.k, args.iterations, args.repeat, not args.no_memory)
+
+    report = {'python': platform.python_version(), 'numpy': np.__version__,
+              'platform': platform.platform(), 'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'k': args.k, 'iterations': args.iterations, 'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent = 1)
+    print("Results written to", args.output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, args.time_floor)
+        for run, field, old, new in regressions:
+            print("REGRESSION %s %s %s: %s -> %s" % (run['dataset'], run['solver'], field, old, new))
+        print(len(regressions), "regressions against", args.baseline)
+        if regressions:
+            sys.exit(1)
+
+
+def parse_args():
+        import argparse
+        parser = argparse.ArgumentParser()
+        parser.add_argument('--data', default = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                             os.pardir, 'data'),
+                            help = 'directory of the shipped data_*.csv files')
+        parser.add_argument('--sizes', type = lambda text: [int(n) for n in text.split(',') if n],
+                            default = [10 ** 4, 10 ** 5, 10 ** 6],
+                            help = 'comma separated sizes of the synthetic data sets')
+        parser.add_argument('--synthetic-only', action = 'store_true',
+                            help = 'skip the shipped data sets')
+        parser.add_argument('--solvers', nargs = '*', choices = [name for name, dummy in SOLVERS],
+                            help = 'solvers to run (default: all)')
+        parser.add_argument('-k', type = int, default = 3, help = 'number of clusters')
+        parser.add_argument('--iterations', type = int, default = 20, help = 'k-means iterations')
+        parser.add_argument('--repeat', type = int, default = None,
+                            help = 'timed runs, best one kept (default: 1, or %d with --baseline)'
+                            % BASELINE_REPEAT)
+        parser.add_argument('--seed', type = int, default = 0, help = 'synthetic data seed')
+        parser.add_argument('--no-memory', action = 'store_true',
+                            help = 'skip the traced run measuring peak memory')
+        parser.add_argument('--output', default = 'benchmark.json', help = 'JSON results file')
+        parser.add_argument('--baseline', help = 'JSON results of an earlier run to compare with')
+        parser.add_argument('--tolerance', type = float, default = 0.25,
+                            help = 'allowed relative slowdown or memory growth')
+        parser.add_argument('--time-floor', type = float, default = TIME_FLOOR, metavar = 'SECONDS',
+                            help = 'ignore slowdowns smaller than this many seconds')
+        return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,63 +1,157 @@
 """
-Naive brute force implementation to solve CSP.
+Naive brute force implementation to solve CSP, plus the exact branch and
+bound solver of exact_search over the same potential container points.
 
 Stony Brook University, NY, February 2016
 """
 
-from ContainerPTAS import readFile, plot2D, potentialContainer
+from ContainerPTAS import readFile, candidateArray
+from ContainerKmeans import coresetTable, dataHash
+from exact_search import branchAndBound, parallelSearch, warmStart
+from PointIndex import PointIndex
+from SolutionCache import SolutionCache
+import clustering_matplotlib
 from clustering_matplotlib import plot_clusters
-from clustering_algorithms import closestCorner
+from clustering_algorithms import closestCorner, label_clustering
 from itertools import combinations
 from Cluster import Cluster
+import instrumentation as inst
 import time
 
 __author__ = 'CalebAndrade'
 
+#******************************************************************************
+# Naive search
+#******************************************************************************
+
+def bruteForce(singletons, potential_container, k):
+    """
+    Try every combination of k potential container points.
+    Returns ((best cost, best cluster list), number of combinations)
+    """
+
+    best = (float('inf'), [])
+    i = infeasible = 0
+    with inst.phase('search'):
+        for corners in combinations(potential_container, k):
+            i += 1
+            cluster_list, count = closestCorner(singletons, corners)
+            if count == len(singletons):
+                cost = sum([cluster.cost() for cluster in cluster_list])
+                if cost < best[0]:
+                    best = cost, cluster_list
+            else:
+                infeasible += 1
+    inst.count('combinations', i)
+    inst.count('pruned', infeasible)
+
+    return best, i
+
 #******************************************************************************
 # Main method
-#******************************************************************************        
+#******************************************************************************
 
 def main():
     args = parse_args()
-    
+    inst.run(solve, args)
+
+
+def solve(args):
+    """ Run the solver for the parsed command line arguments """
+
     data = readFile(args.infile1)
     k = int(args.infile2)
-    
-    print "Displaying", k, "optimal clusters"
+
+    print("Displaying", k, "optimal clusters")
 
     # build an initial cluster list, each point as a single cluster
     singletons = [Cluster(set([x[0]]), x[1], x[2], x[3], (x[1], x[2])) for x in data ]
-       
-    # Build set of potential container points (PCP)
-    potential_container = potentialContainer(data)
-    print "Number of potential container points", len(potential_container)
-    
-    # Brute force...
-    tic = time.clock()
-    best = (float('inf'), [])
-    i = 0
-    for corners in combinations(potential_container, k):
-        i += 1
-        cluster_list, count = closestCorner(singletons, corners)
-        if count == len(singletons):
-            cost = sum([cluster.cost() for cluster in cluster_list])
-            if cost < best[0]:
-                best = cost, cluster_list
-    toc = time.clock()
-
-    print "Total combinations", i
-    print "Best cost", best[0]
-    print "Running time", toc - tic
-    plot_clusters(data, best[1], fs = 4, weights_on = False)
-   
-        
+
+    # optionally search on a weighted coreset of the points
+    table, points = data, singletons
+    if args.coreset > 0:
+        table, dummy_mapping, distortion = coresetTable(data, args.coreset)
+        points = [Cluster(set([x[0]]), x[1], x[2], x[3], (x[1], x[2])) for x in table]
+        print("Coreset of", len(table), "points, cost distortion bound", distortion)
+
+    # Build set of potential container points (PCP) that may be optimal
+    potential_container = candidateArray(table)
+    print("Number of potential container points", len(potential_container))
+
+    tic = time.perf_counter()
+    cache = None
+    if not args.no_cache:
+        cache = SolutionCache()
+        data_hash = dataHash(args.infile1)
+        params = {'solver': 'exact', 'method': args.method, 'k': k, 'coreset': args.coreset}
+    hit = cache.get(data_hash, params) if cache else None
+    if hit:
+        arrays, info = hit
+        cluster_list = label_clustering(singletons, arrays['labels'], k).to_clusters()
+        best = info['cost'], cluster_list
+        print("Solution cache hit")
+    elif args.method == 'naive' and args.workers > 1:
+        cost, corners, i, dummy_pruned, dummy_expired = parallelSearch(table, potential_container, k,
+                                                        float('inf'), args.workers, 'naive')
+        best = (float('inf'), [])
+        if corners:
+            cluster_list = closestCorner(points, corners)[0]
+            best = sum([cluster.cost() for cluster in cluster_list]), cluster_list
+        print("Total combinations", i)
+    elif args.method == 'naive':
+        # Brute force...
+        potential_container = [tuple(corner) for corner in potential_container.tolist()]
+        best, i = bruteForce(points, potential_container, k)
+        print("Total combinations", i)
+    else:
+        incumbent, corners = float('inf'), []
+        if args.warm_start > 0:
+            incumbent, corners = warmStart(table, points, k, args.warm_start)
+            print("Warm start cost", incumbent)
+        cost, found, nodes, pruned, dummy_expired = branchAndBound(table, potential_container, k, incumbent,
+                                                    args.workers)
+        if found:
+            corners = found
+        best = (float('inf'), [])
+        if corners:
+            cluster_list = closestCorner(points, corners)[0]
+            best = sum([cluster.cost() for cluster in cluster_list]), cluster_list
+        print("Nodes visited", nodes)
+        print("Candidates pruned", pruned)
+    if args.coreset > 0 and not hit and best[1]:
+        # containers covering the representatives cover their points too
+        corners = [cluster.corner() for cluster in best[1] if cluster.fips_codes()]
+        cluster_list = closestCorner(singletons, corners)[0]
+        best = sum([cluster.cost() for cluster in cluster_list]), cluster_list
+    if cache and not hit and best[1]:
+        labels = PointIndex.from_table(data).labels(best[1])
+        cache.put(data_hash, params, {'labels': labels}, {'cost': best[0]})
+    toc = time.perf_counter()
+
+    print("Best cost", best[0])
+    print("Running time", toc - tic)
+    plot_clusters(data, best[1], fs = 4, weights_on = False,
+                  **clustering_matplotlib.plot_options(args, 'exact'))
+
+
 def parse_args():
         import argparse
         parser = argparse.ArgumentParser()
         parser.add_argument('infile1', help ='data table file')
         parser.add_argument('infile2', help ='number of clusters')
+        parser.add_argument('--method', choices = ['bnb', 'naive'], default = 'bnb',
+                            help = 'branch and bound (default) or plain enumeration')
+        parser.add_argument('--warm-start', type = int, default = 0,
+                            help = 'k-means iterations for the initial incumbent (0: off)')
+        parser.add_argument('--workers', type = int, default = 1,
+                            help = 'number of worker processes')
+        parser.add_argument('--coreset', type = int, default = 0, metavar = 'CELLS',
+                            help = 'search on a weighted coreset snapped to a CELLS x CELLS grid')
+        parser.add_argument('--no-cache', action = 'store_true',
+                            help = 'neither read nor store the solution in the solution cache')
+        clustering_matplotlib.add_arguments(parser)
+        inst.add_arguments(parser)
         return parser.parse_args()
 
 if __name__ == '__main__':
     main()
-    
\ No newline at end of file
@@ -5,8 +5,22 @@ Stony Brook University, NY, February 2016
 """
 
 from Cluster import Cluster
-from clustering_algorithms import hierarchical_clustering, kmeans_clustering, closestCorner
+from clustering_algorithms import (hierarchical_clustering, kmeans_labels, kmeans_restarts, csp_labels,
+                                   corner_labels, label_clustering, coreset_clusters, map_back,
+                                   refine_labels)
+from clustering_coreset import grid_coreset
+from clustering_numpy import SEEDINGS, kmeans_sweep
+from clustering_streaming import minibatch_kmeans, stream_reassign
+import clustering_matplotlib
 from clustering_matplotlib import plot_clusters
+from PointIndex import PointIndex
+from SolutionCache import SolutionCache, write_atomic
+import hashlib
+import instrumentation as inst
+import itertools
+import json
+import numpy as np
+import os
 import time
 
 __author__ = 'CalebAndrade'
@@ -18,58 +32,310 @@ __author__ = 'CalebAndrade'
 def readFile(filename):
     """ Read data file """
     
-    data = []
+    with inst.phase('load'):
+        table = readTable(filename)
+        data = [[str(row[0]), row[1], row[2], row[3], row[4]] for row in table.tolist()]
+    
+    print("\nLoaded", len(data), "data points")
+    return data
+
+
+def coresetTable(data, cells):
+    """
+    Weighted grid coreset of a data table (see clustering_coreset.grid_coreset)
+    as a data table: one row per nonempty cell, placed at the cell's upper
+    right corner so that dominating the row dominates all of its points.
+
+    Returns (rows, mapping, distortion), mapping[i] being the row of the
+    representative of data[i]
+    """
+
+    xs = np.array([line[1] for line in data], dtype = float)
+    ys = np.array([line[2] for line in data], dtype = float)
+    ws = np.array([line[3] for line in data])
+    mapping, arrays, distortion = grid_coreset(xs, ys, ws, cells)
+    rows = [['cell%d' % idx, cx, cy, w, 0.0]
+            for idx, (cx, cy, w) in enumerate(zip(arrays[3].tolist(), arrays[4].tolist(),
+                                                  arrays[2].tolist()))]
+
+    return rows, mapping, distortion
+
+
+def parseTable(source):
+    """
+    Parse a data file name, or a list of its lines (ID, x, y, weight, error
+    per line), in bulk into a structured array with fields fips, x, y, pop
+    and err
+    """
+
+    if isinstance(source, str):
+        with open(source) as f:
+            source = f.readlines()
+    lines = [line for line in source if line.strip()] # skip blank lines
+    values = np.empty((0, 4))
+    if lines:
+        values = np.loadtxt(lines, delimiter = ',', usecols = (1, 2, 3, 4), ndmin = 2)
+    fips = [line.split(',', 1)[0] for line in lines]
+    width = max([len(code) for code in fips], default = 1)
+    table = np.empty(len(lines), dtype = [('fips', 'U%d' % width), ('x', float), ('y', float),
+                                          ('pop', np.int64), ('err', float)])
+    table['fips'] = fips
+    table['x'] = values[:, 0]
+    table['y'] = values[:, 1]
+    table['pop'] = values[:, 2]
+    table['err'] = values[:, 3]
+
+    return table
+
+
+def iterTable(filename, chunk_size):
+    """
+    Read a data file as a sequence of structured arrays (see parseTable)
+    of at most chunk_size rows, holding one chunk in memory at a time
+    """
+
     with open(filename) as f:
         while True:
-            line = f.readline()
-            if line == '':
+            lines = list(itertools.islice(f, chunk_size))
+            if len(lines) == 0:
                 break
-            row = line.split(',')
-            data.append([row[0], float(row[1]), float(row[2]), int(row[3]), float(row[4])])
-    
-    print "\nLoaded", len(data), "data points"
-    return data
+            with inst.phase('load'):
+                table = parseTable(lines)
+            if len(table) > 0:
+                yield table
+
+
+def fileHash(filename):
+    """ SHA-1 of a file's content """
+
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def readTable(filename, cache = True):
+    """
+    Read a data file into a structured array (see parseTable).
+
+    The parsed table is cached next to the file as <filename>.npy, with a
+    <filename>.key sidecar holding the source's mtime, size and SHA-1.
+    While the mtime and size match, the cache is memory-mapped without
+    reading the source; if they changed but the hash did not, the key is
+    refreshed. Otherwise the file is parsed and the cache rewritten.
+    """
+
+    if not cache:
+        return parseTable(filename)
+
+    info = os.stat(filename)
+    cache_file, key_file = filename + '.npy', filename + '.key'
+    key = {'mtime': info.st_mtime_ns, 'size': info.st_size}
+    try:
+        with open(key_file) as f:
+            stored = json.load(f)
+        if os.path.exists(cache_file):
+            if all([stored.get(name) == key[name] for name in key]):
+                return np.load(cache_file, mmap_mode = 'r')
+            key['sha1'] = fileHash(filename)
+            if stored.get('sha1') == key['sha1']:
+                write_atomic(key_file, lambda f: f.write(json.dumps(key).encode()))
+                return np.load(cache_file, mmap_mode = 'r')
+    except (OSError, ValueError):
+        pass
+
+    table = parseTable(filename)
+    key['sha1'] = key.get('sha1') or fileHash(filename)
+    try:
+        write_atomic(cache_file, lambda f: np.save(f, table))
+        write_atomic(key_file, lambda f: f.write(json.dumps(key).encode()))
+    except OSError:
+        pass # read-only location, run without a cache
+
+    return table
+
+
+def dataHash(filename):
+    """
+    SHA-1 of a data file, read from its table cache key (see readTable)
+    while that is current
+    """
+
+    info = os.stat(filename)
+    try:
+        with open(filename + '.key') as f:
+            stored = json.load(f)
+        if (stored.get('mtime') == info.st_mtime_ns and stored.get('size') == info.st_size
+                and stored.get('sha1')):
+            return stored['sha1']
+    except (OSError, ValueError):
+        pass
+
+    return fileHash(filename)
 
 #******************************************************************************
 # Load data, compute a CSP Kmeans solution and visualize results
 #******************************************************************************
 
+def streamMain(filename, k, passes, chunk_size):
+    """
+    Mini-batch CSP kmeans reading the data file chunk by chunk, followed by
+    a streaming reassignment to the closest dominating corners
+    """
+
+    def chunks():
+        return ((table['x'], table['y'], table['pop']) for table in iterTable(filename, chunk_size))
+
+    tic = time.perf_counter()
+    centers, weights, corners = minibatch_kmeans(chunks, k, passes)
+    lower_bound = [0.0]
+    def addBound(xs, ys, ws, labels):
+        lower_bound[0] += np.dot(ws, xs + ys)
+    centers2, weights2, corners2, count = stream_reassign(chunks(), corners, addBound)
+    toc = time.perf_counter()
+    print("Streamed", count, "data points in chunks of", chunk_size)
+    print("Passes", passes)
+
+    cost1 = np.dot(weights, corners.sum(axis = 1))
+    cost2 = np.dot(weights2, corners2.sum(axis = 1))
+    print("Total cost CSP kmeans        ", cost1)
+    print("Total cost reassigned points ", cost2)
+    print("Total cost lower_bound       ", lower_bound[0])
+    print("Appx ratio to lower_bound    ", cost2 / lower_bound[0])
+    print("Running time                 ", toc - tic)
+
+
+def sweepMain(filename, k_min, k_max, iterations, init, seed):
+    """
+    Cost versus k curve for k_min..k_max from one load of the data file,
+    every k warm-started from the previous one
+    """
+
+    table = readTable(filename)
+    xs, ys, ws = table['x'], table['y'], table['pop']
+    tic = time.perf_counter()
+    curve = kmeans_sweep(xs, ys, ws, range(k_min, k_max + 1), iterations,
+                         init = init, seed = seed)[0]
+    toc = time.perf_counter()
+    lower_bound = np.dot(ws, xs + ys)
+
+    print("Total cost lower_bound       ", lower_bound)
+    print("%4s %22s %22s %8s %10s %10s" % ('k', 'cost CSP kmeans', 'cost reassigned',
+                                           'ratio', 'iterations', 'seconds'))
+    for row in curve:
+        print("%4d %22.2f %22.2f %8.4f %10d %10.4f" % (row['k'], row['cost'], row['reassigned_cost'],
+                                                     row['reassigned_cost'] / lower_bound,
+                                                     row['iterations'], row['seconds']))
+    if len(curve) < k_max - k_min + 1:
+        print("Stopped at k =", k_min + len(curve), "the points allow no more clusters")
+    print("Running time                 ", toc - tic)
+
+
 def main():
     args = parse_args()
+    inst.run(solve, args)
+
+
+def solve(args):
+    """ Run the solver for the parsed command line arguments """
     
-    data = readFile(args.infile1)
     k = int(args.infile2)
     m = int(args.infile3)
+    if args.stream > 0:
+        streamMain(args.infile1, k, m, args.stream)
+        return
+    if args.sweep > 0:
+        sweepMain(args.infile1, k, args.sweep, m, args.init or 'heaviest', args.seed)
+        return
+
+    data = readFile(args.infile1)
     
     # build an initial cluster list, each point as a single cluster
     singletons = [Cluster(set([x[0]]), x[1], x[2], x[3], (x[1], x[2])) for x in data ]
      
     # compute clusters
-    tic = time.clock()
-    cluster_list = kmeans_clustering(singletons, k, m)	
-    toc = time.clock()
-    print "Displaying", len(cluster_list), "k-means clusters"
-    print "Iterations", m
-
-    # compute minimal dominant point with l1-norm for each cluster
-    corners = [cluster.corner() for cluster in cluster_list]
-    
+    tic = time.perf_counter()
+    # solutions are cached unless a time budget makes them nondeterministic
+    cache = None
+    if not args.no_cache and args.budget is None:
+        cache = SolutionCache()
+        data_hash = dataHash(args.infile1)
+        params = {'solver': 'kmeans', 'k': k, 'iterations': m, 'restarts': args.restarts,
+                  'init': args.init, 'seed': args.seed, 'coreset': args.coreset,
+                  'objective': 'csp' if args.csp else 'kmedians' if args.medians else 'kmeans'}
+    hit = cache.get(data_hash, params) if cache else None
+    if hit:
+        arrays, stats = hit
+        clustering = label_clustering(singletons, arrays['labels'], len(arrays['centers']),
+                                      (arrays['centers'], arrays['weights'], arrays['corners']))
+        print("Solution cache hit")
+    else:
+        stats = {}
+        points = singletons
+        if args.coreset > 0:
+            points, mapping, distortion = coreset_clusters(singletons, args.coreset)
+            print("Coreset of", len(points), "points, cost distortion bound", distortion)
+        if args.restarts > 1:
+            clustering = kmeans_restarts(points, k, m, args.restarts, args.init or 'kmeans++',
+                                         args.seed, args.workers, args.budget, stats,
+                                         args.medians)
+        elif args.csp:
+            clustering = csp_labels(points, k, m, stats, args.init or 'heaviest', args.seed)
+        else:
+            clustering = kmeans_labels(points, k, m, stats, args.init or 'heaviest', args.seed,
+                                       args.medians)
+        if args.coreset > 0:
+            clustering = map_back(clustering, singletons, mapping)
+        if cache:
+            cache.put(data_hash, params, {'labels': clustering.labels(),
+                                          'centers': clustering.centers(),
+                                          'weights': clustering.weights(),
+                                          'corners': clustering.corners()}, stats)
+    toc = time.perf_counter()
+    print("Displaying", len(clustering), "k-means clusters")
+    print("Iterations", m)
+    print("Iterations to convergence", stats['iterations'])
+    if args.restarts > 1:
+        print("Restarts run", stats['restarts'], "of", args.restarts)
+        print("Best restart", stats['best_restart'])
+    elif args.csp:
+        print("Seeding", args.init or 'heaviest')
+        print("Marginal cost evaluations", stats['marginal_evaluations'])
+    else:
+        print("Seeding", args.init or 'heaviest')
+        print("Distance evaluations skipped", stats['distance_skipped'], "of",
+              stats['distance_skipped'] + stats['distance_evaluations'])
+
     # reassign points to closest corner
-    cluster_reassign = closestCorner(singletons, corners)[0]
+    reassign = corner_labels(singletons, clustering.corners())
+    if args.refine is not None:
+        # improve the reassigned corners by local search
+        refine_stats = {}
+        start = time.perf_counter()
+        reassign = refine_labels(singletons, reassign.corners(), args.refine, args.patience,
+                                 refine_stats)
+        print("Local search moves applied", refine_stats['improvements'], "in",
+              refine_stats['visits'], "corner visits,", time.perf_counter() - start, "s")
 
     # draw clusters
-    plot_clusters(data, cluster_list, fs = 10, weights_on = False) 
-    plot_clusters(data, cluster_reassign, fs = 10, weights_on = False) 
+    plot_clusters(data, clustering, fs = 10, weights_on = False,
+                  **clustering_matplotlib.plot_options(args, 'kmeans'))
+    plot_clusters(data, reassign, fs = 10, weights_on = False,
+                  **clustering_matplotlib.plot_options(args, 'reassigned'))
 
-    # compare costs
-    lower_bound = sum([x[3]*(x[1] + x[2]) for x in data])
-    cost1 = sum([cluster.cost() for cluster in cluster_list])
-    cost2 = sum([cluster.cost() for cluster in cluster_reassign])
-    print "Total cost CSP kmeans        ", cost1
-    print "Total cost reassigned points ", cost2
-    print "Total cost lower_bound       ", lower_bound
-    print "Appx ratio to lower_bound    ", cost2 / lower_bound
-    print "Running time                 ", toc - tic
+    # compare costs, scoring both solutions in one pass
+    index = PointIndex.from_table(data)
+    lower_bound = index.lower_bound()
+    scores = index.evaluate([clustering.labels(), reassign.labels()],
+                            [clustering.corners(), reassign.corners()])
+    cost1, cost2 = index.total(scores)[0]
+    print("Total cost CSP kmeans        ", cost1)
+    print("Total cost reassigned points ", cost2)
+    print("Total cost lower_bound       ", lower_bound)
+    print("Appx ratio to lower_bound    ", cost2 / lower_bound)
+    print("Running time                 ", toc - tic)
 
 
 def parse_args():
@@ -77,8 +343,46 @@ def parse_args():
         parser = argparse.ArgumentParser()
         parser.add_argument('infile1', help ='data table file')
         parser.add_argument('infile2', help ='number of clusters')
-        parser.add_argument('infile3', help ='number of iterations')
-        return parser.parse_args()
+        parser.add_argument('infile3', help ='number of iterations (passes with --stream)')
+        parser.add_argument('--stream', type = int, default = 0, metavar = 'CHUNK',
+                            help = 'run mini-batch kmeans reading CHUNK rows at a time')
+        parser.add_argument('--coreset', type = int, default = 0, metavar = 'CELLS',
+                            help = 'solve on a weighted coreset snapped to a CELLS x CELLS grid')
+        parser.add_argument('--no-cache', action = 'store_true',
+                            help = 'neither read nor store the solution in the solution cache')
+        parser.add_argument('--sweep', type = int, default = 0, metavar = 'KMAX',
+                            help = 'print the cost curve for k = number of clusters .. KMAX')
+        parser.add_argument('--restarts', type = int, default = 1, metavar = 'R',
+                            help = 'keep the best of R seedings by reassigned CSP cost')
+        parser.add_argument('--init', choices = SEEDINGS, default = None,
+                            help = 'k-means seeding (default heaviest); with --restarts, '
+                                   'of every restart but the first (default kmeans++)')
+        parser.add_argument('--seed', type = int, default = 0,
+                            help = 'random seed of the seeding and restarts')
+        parser.add_argument('--workers', type = int, default = 1,
+                            help = 'number of processes running restarts')
+        parser.add_argument('--budget', type = float, default = None, metavar = 'SECONDS',
+                            help = 'wall-clock limit for the restarts')
+        clustering_matplotlib.add_arguments(parser)
+        parser.add_argument('--csp', action = 'store_true',
+                            help = 'iterate on the CSP cost instead of k-means distances '
+                                   '(not with --restarts)')
+        parser.add_argument('--medians', action = 'store_true',
+                            help = 'k-medians: move centers to weighted medians, which '
+                                   'minimize the manhattan distances')
+        parser.add_argument('--refine', type = float, default = None, metavar = 'SECONDS',
+                            help = 'improve the reassigned corners by local search for at '
+                                   'most SECONDS (inf: until a local optimum)')
+        parser.add_argument('--patience', type = int, default = None, metavar = 'N',
+                            help = 'with --refine, stop after N corner visits without '
+                                   'improvement (default: number of clusters)')
+        inst.add_arguments(parser)
+        args = parser.parse_args()
+        if args.csp and args.restarts > 1:
+            parser.error('--csp does not combine with --restarts')
+        if args.csp and args.medians:
+            parser.error('--csp does not combine with --medians')
+        return args
 
 
 if __name__ == '__main__':
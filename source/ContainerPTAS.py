@@ -8,8 +8,18 @@ Stony Brook University, NY, February 2016
 """
 
 import math
+import instrumentation as inst
+import numpy as np
+import time
 from matplotlib import pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from Cluster import Cluster
 from ContainerKmeans import readFile
+from clustering_algorithms import closestCorner
+from exact_search import branchAndBound, warmStart
+import clustering_matplotlib
+from clustering_matplotlib import plot_clusters
 
 __author__ = 'CalebAndrade'
 
@@ -17,19 +27,32 @@ __author__ = 'CalebAndrade'
 # Code to make a simple data point plot
 #******************************************************************************
 
-def plot2D(points, color_value, size, fs):
-    """ Plots a set of 2D points """
-    x = [point[0] for point in points]
-    y = [point[1] for point in points]
-    x_range = max(x)
-    y_range = max(y)
-    # adjust image size
-    plt.figure(figsize=(fs, 1 + int(fs*float(y_range) / x_range))) 
-    axes = plt.gca() # set plot's x and y ranges
-    axes.set_xlim([0,1 + int(1.05*x_range)])
-    axes.set_ylim([0,1 + int(1.05*y_range)])
-    plt.scatter(x, y, s = size, lw = 0, color = color_value)
-    plt.show()
+def plot2D(points, color_value, size, fs, filename = None, max_points = None, seed = 0):
+    """
+    Plots a set of 2D points, saved off screen to filename if given (see
+    clustering_matplotlib.plot_clusters), at most max_points of them
+    """
+    points = np.asarray(points, dtype = float).reshape(-1, 2)
+    x_range, y_range = points.max(axis = 0)
+    if max_points is not None and len(points) > max_points:
+        chosen = np.random.default_rng(seed).choice(len(points), max_points, replace = False)
+        points = points[chosen]
+    with inst.phase('plot'):
+        if filename is None:
+            figure = plt.figure()
+        else:
+            figure = Figure()
+            FigureCanvasAgg(figure)
+        # adjust image size
+        figure.set_size_inches(fs, 1 + int(fs*float(y_range) / x_range))
+        axes = figure.add_subplot(111) # set plot's x and y ranges
+        axes.set_xlim([0,1 + int(1.05*x_range)])
+        axes.set_ylim([0,1 + int(1.05*y_range)])
+        axes.scatter(points[:, 0], points[:, 1], s = size, lw = 0, color = color_value)
+        if filename is not None:
+            figure.savefig(filename)
+    if filename is None:
+        plt.show()
 
                 
 #******************************************************************************
@@ -37,106 +60,283 @@ def plot2D(points, color_value, size, fs):
 #******************************************************************************
 
 def potentialContainer(data):
-    """ Build set of potential container points """
-    
-    x_set = [point[1] for point in data] # y coordinates of points
-    y_set = [point[2] for point in data] # x coordinates of points
-        
-    # build all possible potential container points, without repeats
-    potential_container = set([]) 
-    for x in x_set:
-        for y in y_set:
-            potential_container.add((x, y))
-            
-    return list(potential_container)
+    """
+    Build the list of potential container points that may be optimal (the
+    reduced set of candidateCorners)
+    """
+
+    return [tuple(corner) for corner in candidateArray(data).tolist()]
+
+
+def candidateCorners(data, chunk_size = 65536):
+    """
+    Lazily generate, in (c, 2) array chunks of about chunk_size rows, the
+    potential container points that may belong to an optimal solution.
+
+    A corner (X, Y) is kept only if it is the upper right corner of the
+    points it dominates: some dominated point has x == X and some dominated
+    point has y == Y. Any other corner can be shrunk to that one, dominating
+    the same points at a lower cost, so optimal solutions never need it.
+    """
+
+    xs = np.array([point[1] for point in data], dtype = float)
+    ys = np.array([point[2] for point in data], dtype = float)
+
+    # lowest y on every vertical line x == X
+    order = np.lexsort((ys, xs))
+    x_set, starts = np.unique(xs[order], return_index = True)
+    low_y = ys[order][starts]
+
+    # leftmost x on every horizontal line y == Y
+    y_set, inverse = np.unique(ys, return_inverse = True)
+    first_x = np.full(len(y_set), np.inf)
+    np.minimum.at(first_x, inverse, xs)
+
+    chunk, size = [], 0
+    for x, y in zip(x_set, low_y):
+        start = np.searchsorted(y_set, y)
+        y_line = y_set[start:][first_x[start:] <= x]
+        chunk.append(np.column_stack((np.full(len(y_line), x), y_line)))
+        size += len(y_line)
+        if size >= chunk_size:
+            yield np.concatenate(chunk)
+            chunk, size = [], 0
+    if size > 0:
+        yield np.concatenate(chunk)
+
+
+def candidateArray(data):
+    """ Build the (m, 2) array of reduced potential container points """
+
+    with inst.phase('candidates'):
+        chunks = list(candidateCorners(data))
+    candidates = np.concatenate(chunks) if chunks else np.empty((0, 2))
+    inst.count('candidate_corners', len(candidates))
+
+    return candidates
   
 
-def findSection(points, slopes):
-    """ Build hash of the sections to which points belong """
-    
-    sections = {slope:[] for slope in slopes} # initialize hash
-    # compare point's slope with slopes
-    for point in points:
-        for slope in slopes:
-            if slope <= point[1] / point[0]: 
-                sections[slope].append(point)
-                break
-    
-    return sections
+def raySlopes(num_slices):
+    """ Slopes of the rays, decreasingly, and the angle between rays """
 
+    if num_slices < 2:
+        raise ValueError("the ray transformation needs at least 2 rays")
+    theta = math.pi / (2*num_slices)
 
-def transPoint(point, slope1, slope2):
-    """ Single container point transformation """
-    
-    # compute deltas
-    delta_v = point[0]*slope2 - point[1]
-    if slope1 == 0:
-        delta_u = float('inf')
-    else:
-        delta_u = point[1]/slope1 - point[0]
-    
-    # decide what transformation to apply
-    if delta_u < delta_v:
-        return (point[0] + delta_u, point[1]), slope1
-    else:
-        return (point[0], point[1] + delta_v), slope2  
+    return sorted([math.tan(i*theta) for i in range(num_slices)], reverse = True), theta
+
+
+def sectionIndex(points, slopes):
+    """
+    Index into the decreasing slopes of the section of each point of a
+    (m, 2) array: the first slope <= y/x, found by binary search
+    """
+
+    ascending = np.array(slopes[::-1])
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        ratios = points[:, 1] / points[:, 0]
+    below = np.searchsorted(ascending, ratios, side = 'right')
+
+    return len(slopes) - np.maximum(below, 1)
+
+
+def transArray(points, sections, slopes):
+    """
+    Move every point of a (m, 2) array, in the given sections, onto the
+    closer of its section's two rays, horizontally or vertically. Returns
+    the (m, 2) array of transformed points and the index of each one's ray
+    """
+
+    slopes = np.array(slopes)
+    upper = np.maximum(sections - 1, 0)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        delta_v = np.where(sections == 0, np.inf,
+                           points[:, 0]*slopes[upper] - points[:, 1])
+        delta_u = np.where(slopes[sections] == 0, np.inf,
+                           points[:, 1]/slopes[sections] - points[:, 0])
+    right = delta_u < delta_v
+
+    transformed = points.copy()
+    transformed[right, 0] += delta_u[right]
+    transformed[~right, 1] += delta_v[~right]
+
+    return transformed, np.where(right, sections, upper)
         
 
 def profileRT(transformed):
     """ A rough estimate of running time in years to compute profiles """
+
+    profileEstimate([len(line) for line in transformed.values()])
+
+
+def profileEstimate(counts):
+    """ profileRT from the number of transformed points on each ray """
     
     profiles = 1 
-    for line in transformed.values():
-        if len(line) > 0:
-            profiles *= len(line)
-    print "Total profiles: ", profiles
-    avg_ray = sum([len(line) for line in transformed.values()])/len(transformed)
+    for count in counts:
+        if count > 0:
+            profiles *= int(count)
+    print("Total profiles: ", profiles)
+    avg_ray = int(sum(counts)) // len(counts)
     speed = 60*60*24*365*(10**9) # considering 1x10^9 ops/sec
     profile_runtime = float(profiles)/speed
-    print "Profile construction running time (years): ", profile_runtime
-    print "Rough estimate total running time (years): ", avg_ray*profile_runtime/2
+    print("Profile construction running time (years): ", profile_runtime)
+    print("Rough estimate total running time (years): ", avg_ray*profile_runtime/2)
     
 
 def transPC(potential_container, num_slices):
     """ Transform potential container points """
     
-    theta = math.pi / (2*num_slices)
+    slopes, theta = raySlopes(num_slices)
     epsilon = 2*theta
-    print "\nEpsilon: ", epsilon
+    print("\nEpsilon: ", epsilon)
     
-    # sort slopes decreasingly
-    slopes = sorted([math.tan(i*theta) for i in range(num_slices)], reverse = True)
-    sections = findSection(potential_container, slopes)
+    points = np.asarray(potential_container, dtype = float).reshape(-1, 2)
+    sections = sectionIndex(points, slopes)
+    order = np.argsort(sections, kind = 'stable') # section by section, as listed
+    with inst.phase('transform'):
+        t_points, rays = transArray(points[order], sections[order], slopes)
     
     transformed = {slope:[] for slope in slopes}
-    for slope1 in sections.keys():
-        for point in sections[slope1]:
-            idx = slopes.index(slope1)
-            if idx == 0:
-                slope2 = float('inf')
-            else:
-                slope2 = slopes[idx - 1]
-            
-            t_point, slope = transPoint(point, slope1, slope2)
-            transformed[slope].append(t_point)
+    for idx, t_point in zip(rays.tolist(), t_points.tolist()):
+        transformed[slopes[idx]].append(tuple(t_point))
 
     profileRT(transformed)    
     
     return transformed   
 
+
+def rayCounts(chunks, num_slices):
+    """
+    Number of transformed potential container points on each ray, in the
+    order of the decreasing slopes, streaming over (c, 2) chunks of points
+    (see candidateCorners) without keeping the transformed points
+    """
+
+    slopes = raySlopes(num_slices)[0]
+    counts = np.zeros(len(slopes), dtype = np.int64)
+    total = 0
+    for points in chunks:
+        with inst.phase('transform'):
+            rays = transArray(points, sectionIndex(points, slopes), slopes)[1]
+            counts += np.bincount(rays, minlength = len(slopes))
+        total += len(points)
+    inst.count('candidate_corners', total)
+
+    return counts.tolist()
+
+#******************************************************************************
+# Approximate solver over the transformed points
+#******************************************************************************
+
+def rayCorners(chunks, num_slices, delta, deadline = None):
+    """
+    Reduced set of corners an approximate solution is built from: the
+    transformed potential container points of the (c, 2) chunks (see
+    candidateCorners), each pushed outward along its ray until x + y is a
+    power of 1 + delta, and merged when they meet. Every corner dominates
+    the potential container points it replaces, at most 1 + delta times
+    their x + y, so each ray holds a logarithmic number of corners.
+    Returns them as an (m, 2) array, or None if the deadline (a
+    time.monotonic() value) passes between chunks.
+    """
+
+    slopes = raySlopes(num_slices)[0]
+    step = math.log1p(delta)
+    corners = {}
+    for points in chunks:
+        if deadline is not None and time.monotonic() > deadline:
+            return None
+        with inst.phase('transform'):
+            t_points, rays = transArray(points, sectionIndex(points, slopes), slopes)
+            t_points = np.maximum(t_points, points) # guard against rounding
+            keys = t_points.sum(axis = 1)
+            positive = keys > 0
+            levels = np.zeros(len(keys), dtype = np.int64)
+            levels[positive] = np.ceil(np.log(keys[positive]) / step)
+            scales = np.ones(len(keys))
+            scales[positive] = np.maximum(np.exp(levels[positive]*step) / keys[positive], 1.0)
+            rounded = t_points * scales[:, None]
+
+            # the corner of a (ray, level) is the largest of its points
+            codes, inverse = np.unique(np.column_stack((rays, levels)), axis = 0,
+                                       return_inverse = True)
+            top = np.full((len(codes), 2), -np.inf)
+            np.maximum.at(top, inverse.reshape(-1), rounded)
+        for code, corner in zip(map(tuple, codes.tolist()), top.tolist()):
+            if code in corners:
+                corner = [max(corner[0], corners[code][0]), max(corner[1], corners[code][1])]
+            corners[code] = corner
+
+    return np.array(list(corners.values()), dtype = float).reshape(-1, 2)
+
+
+def ptasSolve(data, k, num_slices, delta = None, iterations = 10, budget = None,
+              max_corners = None):
+    """
+    Approximate CSP solution: branch and bound over the rayCorners rounded
+    with delta (default epsilon/4), warm-started with k-means, within
+    (1 + epsilon)(1 + delta) of the optimum unless budget (seconds) runs
+    out. Returns (cost, cluster list, info dict).
+    """
+
+    deadline = None if budget is None else time.monotonic() + budget
+    epsilon = 2*raySlopes(num_slices)[1]
+    delta = delta or epsilon / 4
+    singletons = [Cluster(set([x[0]]), x[1], x[2], x[3], (x[1], x[2])) for x in data]
+    incumbent, best = warmStart(data, singletons, k, iterations)
+
+    corners = rayCorners(candidateCorners(data), num_slices, delta, deadline)
+    expired = corners is None
+    while not expired and max_corners is not None and len(corners) > max_corners:
+        coarser = rayCorners(candidateCorners(data), num_slices, 2*delta, deadline)
+        expired = coarser is None
+        if expired or len(coarser) == len(corners):
+            break
+        corners, delta = coarser, 2*delta
+
+    nodes = pruned = 0
+    if not expired:
+        cost, found, nodes, pruned, expired = branchAndBound(data, corners, k, incumbent,
+                                                             deadline = deadline)
+        if found:
+            incumbent, best = cost, found
+    cluster_list = [cluster for cluster in closestCorner(singletons, best)[0]
+                    if cluster.fips_codes()]
+
+    info = {'epsilon': epsilon, 'delta': delta, 'bound': (1 + epsilon)*(1 + delta),
+            'corners': 0 if corners is None else len(corners), 'nodes': nodes,
+            'pruned': pruned, 'complete': not expired}
+    return sum([cluster.cost() for cluster in cluster_list]), cluster_list, info
+
 #******************************************************************************
 # Main method
 #******************************************************************************        
 
 def main():
     args = parse_args()
+    inst.run(solve, args)
+
+
+def solve(args):
+    """ Run the preprocessing for the parsed command line arguments """
     
     data = readFile(args.infile1)
     etha = int(args.infile2)
     plotting = str(args.infile3)
     
-    # Build set of potential container points (PCP)
-    potential_container = potentialContainer(data)
+    if args.solve > 0:
+        solvePTAS(data, args.solve, etha, args, plotting == 'on')
+        return
+
+    if plotting != 'on':
+        # only the number of TPCP on each ray is needed, stream them
+        print("\nEpsilon: ", math.pi / etha)
+        profileEstimate(rayCounts(candidateCorners(data), etha))
+        return
+
+    # Build set of potential container points (PCP) that may be optimal
+    potential_container = candidateArray(data).tolist()
     
     # Build set of transformed potential container points (TPCP)
     transformed = transPC(potential_container, etha)
@@ -145,10 +345,38 @@ def main():
         trans_points += value
         
     # plotting
-    if plotting == 'on':
-        plot2D([(point[1], point[2]) for point in data], 'red', 5, 10) # input 
-        plot2D(potential_container, 'blue', 5, 10) # potential container points
-        plot2D(trans_points, 'green', 5, 10) # transformed container points
+    plot2D([(point[1], point[2]) for point in data], 'red', 5, 10,
+           **clustering_matplotlib.plot_options(args, 'input')) # input
+    plot2D(potential_container, 'blue', 5, 10,
+           **clustering_matplotlib.plot_options(args, 'potential')) # potential container points
+    plot2D(trans_points, 'green', 5, 10,
+           **clustering_matplotlib.plot_options(args, 'transformed')) # transformed container points
+
+
+
+def solvePTAS(data, k, etha, args, plotting):
+    """ Run ptasSolve and report the solution """
+
+    tic = time.perf_counter()
+    cost, cluster_list, info = ptasSolve(data, k, etha, args.delta, args.iterations,
+                                         args.budget, args.max_corners)
+    toc = time.perf_counter()
+    lower_bound = sum([x[3]*(x[1] + x[2]) for x in data])
+
+    print("\nEpsilon", info['epsilon'], "delta", info['delta'])
+    print("Ray corners", info['corners'])
+    print("Nodes visited", info['nodes'])
+    print("Candidates pruned", info['pruned'])
+    if info['complete']:
+        print("Cost within", info['bound'], "times the optimum")
+    else:
+        print("Budget exhausted, best solution found so far")
+    print("Total cost CSP PTAS          ", cost)
+    print("Appx ratio to lower_bound    ", cost / lower_bound)
+    print("Running time                 ", toc - tic)
+    if plotting:
+        plot_clusters(data, cluster_list, fs = 10, weights_on = False,
+                      **clustering_matplotlib.plot_options(args, 'ptas'))
 
         
 def parse_args():
@@ -157,6 +385,18 @@ def parse_args():
         parser.add_argument('infile1', help ='data table file')
         parser.add_argument('infile2', help ='number of rays')
         parser.add_argument('infile3', help ='plotting (on/off)')
+        parser.add_argument('--solve', type = int, default = 0, metavar = 'K',
+                            help = 'solve CSP with K containers instead of estimating')
+        parser.add_argument('--delta', type = float, default = None,
+                            help = 'rounding of the ray corners (default epsilon / 4)')
+        parser.add_argument('--iterations', type = int, default = 10,
+                            help = 'k-means iterations of the initial incumbent')
+        parser.add_argument('--budget', type = float, default = None, metavar = 'SECONDS',
+                            help = 'wall-clock limit of the search')
+        parser.add_argument('--max-corners', type = int, default = None, metavar = 'N',
+                            help = 'coarsen the rounding until at most N ray corners are left')
+        clustering_matplotlib.add_arguments(parser)
+        inst.add_arguments(parser)
         return parser.parse_args()
 
 if __name__ == '__main__':
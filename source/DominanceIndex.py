@@ -0,0 +1,90 @@
+"""
+Nearest dominating corner queries under the l1-norm.
+
+A corner c dominates a point p when p[0] <= c[0] and p[1] <= c[1]; among the
+corners dominating p the closest one in l1-norm is the one with the smallest
+c[0] + c[1]. The index answers all points at once with a sweep line over
+decreasing x and a Fenwick tree of prefix minima over the corners' y ranks,
+in O((n + k) log k) time.
+"""
+
+import numpy as np
+
+
+class DominanceIndex:
+    """
+    Query structure built once per corner set
+    """
+
+    def __init__(self, corners):
+        """
+        Build the index for a sequence of (x, y) corners
+        """
+        corners = np.asarray(corners, dtype=float).reshape(-1, 2)
+        self._corners = corners
+        self._keys = (corners[:, 0] + corners[:, 1]).tolist()
+        # corners swept by decreasing x
+        self._order = np.argsort(-corners[:, 0], kind='stable').tolist()
+        self._xs = corners[:, 0].tolist()
+        # y ranks, reversed so that "y >= value" becomes a prefix
+        self._ys = np.unique(corners[:, 1])
+        ranks = np.searchsorted(self._ys, corners[:, 1])
+        self._slots = (len(self._ys) - ranks).tolist()
+
+    def __len__(self):
+        """
+        Number of corners in the index
+        """
+        return len(self._corners)
+
+    def corners(self):
+        """
+        Get the (k, 2) array of corners
+        """
+        return self._corners
+
+    def query(self, xs, ys):
+        """
+        Input: arrays of point coordinates xs, ys
+
+        Output: (labels, infeasible), where labels[i] is the index of the
+        closest corner dominating point i (lowest index on ties) or -1, and
+        infeasible is the boolean mask of points no corner dominates
+        """
+        xs = np.asarray(xs, dtype=float)
+        ys = np.asarray(ys, dtype=float)
+        labels = np.full(len(xs), -1, dtype=np.intp)
+        size = len(self._ys)
+        if size == 0:
+            return labels, labels < 0
+
+        # number of y slots holding corners with y >= point's y
+        limits = (size - np.searchsorted(self._ys, ys)).tolist()
+        points = np.argsort(-xs, kind='stable').tolist()
+        px = xs.tolist()
+
+        none = (float('inf'), -1)
+        tree = [none] * (size + 1)
+        keys, slots, cx, order = self._keys, self._slots, self._xs, self._order
+        nxt = 0
+        for point in points:
+            # insert every corner to the right of the sweep line
+            while nxt < len(order) and cx[order[nxt]] >= px[point]:
+                idx = order[nxt]
+                item = (keys[idx], idx)
+                pos = slots[idx]
+                while pos <= size:
+                    if item < tree[pos]:
+                        tree[pos] = item
+                    pos += pos & -pos
+                nxt += 1
+            # prefix minimum over the slots above the point
+            best = none
+            pos = limits[point]
+            while pos > 0:
+                if tree[pos] < best:
+                    best = tree[pos]
+                pos -= pos & -pos
+            labels[point] = best[1]
+
+        return labels, labels < 0
@@ -0,0 +1,154 @@
+"""
+Shared index of a data set for scoring whole CSP solutions.
+
+The index is built once per data table: point arrays, the ID to row table
+and every point's lower bound w*(x + y). A solution is then a label array
+(one cluster index per point, -1 for unclustered points), optionally with
+its corners, and all per-cluster scores come out of a few bincount passes.
+Several solutions over the same points can be scored in a single call by
+stacking their label arrays.
+"""
+
+import instrumentation as inst
+import numpy as np
+
+# per-cluster scores returned by PointIndex.evaluate
+SCORES = [('weight', float), ('cost', float), ('lower_bound', float),
+          ('ratio', float), ('error', float), ('utilization', float)]
+
+
+class PointIndex:
+    """
+    Precomputed arrays of a set of weighted points
+    """
+
+    def __init__(self, ids, xs, ys, ws):
+        """
+        Build the index for points with ID's ids, coordinates xs, ys and
+        weights ws
+        """
+        self._ids = list(ids)
+        self._xs = np.asarray(xs, dtype=float)
+        self._ys = np.asarray(ys, dtype=float)
+        self._ws = np.asarray(ws, dtype=float)
+        self._bounds = self._ws * (self._xs + self._ys)
+        self._rows = None
+
+    @classmethod
+    def from_table(cls, data_table):
+        """
+        Build the index of a data table (rows of ID, x, y, weight, ...)
+        """
+        return cls([line[0] for line in data_table],
+                   [line[1] for line in data_table],
+                   [line[2] for line in data_table],
+                   [line[3] for line in data_table])
+
+    def __len__(self):
+        """
+        Number of points in the index
+        """
+        return len(self._xs)
+
+    def fips_to_line(self):
+        """
+        Get the table from ID to row index, built on first use
+        """
+        if self._rows is None:
+            self._rows = dict(zip(self._ids, range(len(self._ids))))
+        return self._rows
+
+    def lower_bound(self):
+        """
+        Total lower bound on the cost of any solution, sum of w*(x + y)
+        """
+        return float(self._bounds.sum())
+
+    def labels(self, cluster_list):
+        """
+        Label array of a list of Cluster (-1 for points in no cluster)
+        """
+        rows = self.fips_to_line()
+        labels = np.full(len(self), -1, dtype=np.intp)
+        for idx in range(len(cluster_list)):
+            labels[[rows[code] for code in cluster_list[idx].fips_codes()]] = idx
+        return labels
+
+    def evaluate(self, labels, corners=None, num_clusters=None):
+        """
+        Score one solution, or a stack of s solutions over the same points.
+
+        Input: labels has shape (n,) or (s, n); corners, if given, has shape
+        (k, 2) or (s, k, 2) and holds the containers' corners, by default the
+        coordinate-wise max of each cluster's points; num_clusters defaults
+        to the number of corners or to the largest label plus one.
+
+        Output: structured array of shape (k,) or (s, k) with fields
+            weight       total weight W of the cluster
+            cost         W*(cx + cy), the CSP cost of its corner (cx, cy)
+            lower_bound  sum of w*(x + y) over its points
+            ratio        cost / lower_bound
+            error        sum of w*d**2, d the manhattan distance from each
+                         point to the cluster's weighted center
+            utilization  lower_bound / cost, the share of the container
+                         the points actually use
+        Empty clusters get nan ratio and utilization.
+        """
+        with inst.phase('evaluate'):
+            return self._scores(labels, corners, num_clusters)
+
+    def _scores(self, labels, corners, num_clusters):
+        """
+        Body of evaluate
+        """
+        labels = np.asarray(labels, dtype=np.intp)
+        single = labels.ndim == 1
+        labels = labels.reshape(-1, len(self))
+        if corners is not None:
+            corners = np.asarray(corners, dtype=float).reshape(len(labels), -1, 2)
+            num_clusters = corners.shape[1]
+        elif num_clusters is None:
+            num_clusters = int(labels.max(initial=-1)) + 1
+
+        # fold the s solutions into one bincount over s*k groups
+        member = labels >= 0
+        groups = (labels + num_clusters * np.arange(len(labels))[:, None])[member]
+        points = np.nonzero(member)[1]
+        size = len(labels) * num_clusters
+        ws = self._ws[points]
+        xs = self._xs[points]
+        ys = self._ys[points]
+
+        scores = np.zeros(size, dtype=SCORES)
+        weight = np.bincount(groups, weights=ws, minlength=size)
+        scores['weight'] = weight
+        scores['lower_bound'] = np.bincount(groups, weights=self._bounds[points], minlength=size)
+        if corners is None:
+            corner = np.zeros((size, 2))
+            np.maximum.at(corner[:, 0], groups, xs)
+            np.maximum.at(corner[:, 1], groups, ys)
+        else:
+            corner = corners.reshape(-1, 2)
+        scores['cost'] = weight * corner.sum(axis=1)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            center_x = np.bincount(groups, weights=ws * xs, minlength=size) / weight
+            center_y = np.bincount(groups, weights=ws * ys, minlength=size) / weight
+            dist = np.abs(xs - center_x[groups]) + np.abs(ys - center_y[groups])
+            scores['error'] = np.bincount(groups, weights=ws * dist ** 2, minlength=size)
+            scores['ratio'] = scores['cost'] / scores['lower_bound']
+            scores['utilization'] = scores['lower_bound'] / scores['cost']
+        empty = weight == 0
+        scores['ratio'][empty] = np.nan
+        scores['utilization'][empty] = np.nan
+
+        scores = scores.reshape(len(labels), num_clusters)
+        return scores[0] if single else scores
+
+    def total(self, scores):
+        """
+        Whole-solution totals of evaluate's output: (cost, ratio to the
+        lower bound of all points, error)
+        """
+        cost = scores['cost'].sum(axis=-1)
+        return cost, cost / self.lower_bound(), scores['error'].sum(axis=-1)
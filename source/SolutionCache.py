@@ -0,0 +1,189 @@
+"""
+Persistent cache of CSP solutions.
+
+Solutions are content addressed: the key is the SHA-1 of the data file's
+hash together with the solver parameters, so a changed data file or a
+different k, number of iterations or algorithm never hits a stale entry.
+Each entry is a compressed .npz holding the solution's arrays (corners,
+labels, costs, ...) plus its parameters and a small JSON record of extra
+information. Entries are written atomically, so readers never see a
+partial file, and the cache is kept under a size bound by evicting the
+least recently used entries (by modification time, refreshed on every
+hit). Writers take an exclusive lock on the directory's lock file while
+storing and evicting, so several processes can share one cache.
+"""
+
+import hashlib
+import json
+import numpy as np
+import os
+import tempfile
+
+try:
+    import fcntl
+except ImportError: # no flock on this platform, writers go unlocked
+    fcntl = None
+
+# default location and size bound of the cache
+CACHE_DIR = os.environ.get('CSP_CACHE_DIR',
+                           os.path.join(os.path.expanduser('~'), '.cache', 'container-selection'))
+CACHE_SIZE = 256 << 20
+
+
+def write_atomic(filename, write):
+    """
+    Write a file through a temporary file in its directory, replacing it
+    atomically. write(f) fills the binary file object f. The file gets the
+    umask's usual mode, not mkstemp's private 0600
+    """
+    handle, temp = tempfile.mkstemp(dir = os.path.dirname(os.path.abspath(filename)),
+                                    suffix = '.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            write(f)
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temp, 0o666 & ~umask)
+        os.replace(temp, filename)
+    except BaseException:
+        os.remove(temp)
+        raise
+
+
+class SolutionCache:
+    """
+    Directory of cached solutions with LRU eviction
+    """
+
+    def __init__(self, directory = CACHE_DIR, max_bytes = CACHE_SIZE):
+        """
+        Open (creating it if needed) the cache in directory, keeping it
+        below max_bytes
+        """
+        self._directory = directory
+        self._max_bytes = max_bytes
+        os.makedirs(directory, exist_ok = True)
+
+    def key(self, data_hash, params):
+        """
+        Content address of a solution: SHA-1 of the data hash and the
+        solver parameters (a JSON serializable dict)
+        """
+        text = json.dumps([data_hash, params], sort_keys = True)
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    def path(self, data_hash, params):
+        """
+        Get the file name of a solution's entry
+        """
+        return os.path.join(self._directory, self.key(data_hash, params) + '.npz')
+
+    def get(self, data_hash, params):
+        """
+        Look up a solution. Returns (arrays, info), arrays a dict of numpy
+        arrays and info the JSON record stored with them, or None on a miss
+        """
+        filename = self.path(data_hash, params)
+        try:
+            with np.load(filename) as entry:
+                arrays = dict((name, entry[name]) for name in entry.files)
+            os.utime(filename) # mark as recently used
+        except (OSError, ValueError):
+            return None # missing, evicted meanwhile or unreadable
+        stored = json.loads(str(arrays.pop('_params')))
+        if stored != [data_hash, json.loads(json.dumps(params))]:
+            return None
+        info = json.loads(str(arrays.pop('_info')))
+
+        return arrays, info
+
+    def put(self, data_hash, params, arrays, info = None):
+        """
+        Store the arrays (a dict of name to array) and the JSON serializable
+        info of a solution, then evict old entries over the size bound
+        """
+        filename = self.path(data_hash, params)
+        record = dict(arrays)
+        record['_params'] = np.array(json.dumps([data_hash, params], sort_keys = True))
+        record['_info'] = np.array(json.dumps(info or {}, sort_keys = True))
+        with self._lock():
+            write_atomic(filename, lambda f: np.savez_compressed(f, **record))
+            self._evict()
+
+    def clear(self):
+        """
+        Remove every entry
+        """
+        with self._lock():
+            for name in os.listdir(self._directory):
+                if name.endswith('.npz'):
+                    self._remove(os.path.join(self._directory, name))
+
+    def size(self):
+        """
+        Total size in bytes of the cached entries
+        """
+        return sum([entry[2] for entry in self._entries()])
+
+    def _entries(self):
+        """
+        List of (mtime, filename, size) of the entries
+        """
+        entries = []
+        for name in os.listdir(self._directory):
+            if name.endswith('.npz'):
+                filename = os.path.join(self._directory, name)
+                try:
+                    info = os.stat(filename)
+                except OSError:
+                    continue
+                entries.append((info.st_mtime_ns, filename, info.st_size))
+        return entries
+
+    def _evict(self):
+        """
+        Remove least recently used entries until the cache fits its bound
+        """
+        entries = sorted(self._entries())
+        total = sum([entry[2] for entry in entries])
+        for dummy_mtime, filename, size in entries:
+            if total <= self._max_bytes:
+                break
+            self._remove(filename)
+            total -= size
+
+    def _remove(self, filename):
+        """
+        Delete an entry, ignoring one already gone
+        """
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            pass
+
+    def _lock(self):
+        """
+        Context manager holding the directory's exclusive writer lock
+        """
+        return _Lock(os.path.join(self._directory, '.lock'))
+
+
+class _Lock:
+    """
+    Exclusive flock on a file, held inside a with block
+    """
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self._filename, 'a')
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
@@ -4,7 +4,15 @@ This code was written as part of a project from Principles of Computing
 Specialization by Rice University & Coursera, 2015.
 """
 
-from Cluster import Cluster
+import heapq
+import instrumentation as inst
+import numpy as np
+from Clustering import Clustering
+from DominanceIndex import DominanceIndex
+from clustering_coreset import grid_coreset
+from clustering_local_search import refine_corners
+from clustering_numpy import (cluster_arrays, csp_lloyd, kmeans_arrays, multistart_kmeans,
+                             seed_indices)
 
 __author__ = 'CalebAndrade'
 
@@ -37,65 +45,120 @@ def fast_closest_pair(cluster_list):
     
     Input: cluster_list is list of clusters SORTED such that horizontal 
     positions of their centers are in ascending order
+
+    A library kernel: hierarchical_clustering keeps nearest neighbors in a
+    heap instead and does not call it.
     """
     
     size = len(cluster_list)
-    if size < 4:
-        return slow_closest_pair(cluster_list)
-    half = size / 2
-    lcl = [] # left cluster list
-    rcl = [] # right cluster list
-    for idx in range(half):
-        lcl.append(cluster_list[idx])
-    for idx in range(half, size):
-        rcl.append(cluster_list[idx])
-    left_ans = fast_closest_pair(lcl)
-    right_ans = fast_closest_pair(rcl)
-    if left_ans[0] < right_ans[0]:
-        temp_ans = left_ans
-    else:
-        temp_ans = (right_ans[0], right_ans[1] + half, right_ans[2] + half)
-    mid = 0.5*(cluster_list[half - 1].horiz_center() + cluster_list[half].horiz_center())
-    cps_ans = closest_pair_strip(cluster_list, mid, temp_ans[0])
-    
-    if cps_ans[0] < temp_ans[0]:
-        return cps_ans
-    else:
-        return temp_ans
+    xs = [cluster.horiz_center() for cluster in cluster_list]
+    ys = [cluster.vert_center() for cluster in cluster_list]
+    order = list(range(size)) # y-order of each solved range, built bottom up
+    scratch = [0] * size # merge and strip buffer, shared by all levels
+
+    return closest_pair_range(xs, ys, 0, size, order, scratch)
+
+
+def closest_pair_range(xs, ys, low, top, order, scratch):
+    """
+    Closest pair among the x-sorted points low..top-1 of xs, ys.
+
+    On return order[low:top] holds those indices sorted by y: the halves'
+    y-orders are merged on the way up instead of sorting each strip, and
+    all work happens in the preallocated order and scratch lists.
+    """
+
+    if top - low < 4:
+        ans = (float('inf'), -1, -1)
+        for idx1 in range(low, top):
+            for idx2 in range(idx1 + 1, top):
+                dist = abs(ys[idx1] - ys[idx2]) + abs(xs[idx1] - xs[idx2])
+                if dist < ans[0]:
+                    ans = (dist, idx1, idx2)
+        # insertion sort of the few indices by y
+        for idx1 in range(low + 1, top):
+            item = order[idx1]
+            idx2 = idx1
+            while idx2 > low and ys[order[idx2 - 1]] > ys[item]:
+                order[idx2] = order[idx2 - 1]
+                idx2 -= 1
+            order[idx2] = item
+        return ans
+
+    half = (low + top) // 2
+    left_ans = closest_pair_range(xs, ys, low, half, order, scratch)
+    right_ans = closest_pair_range(xs, ys, half, top, order, scratch)
+    ans = left_ans if left_ans[0] < right_ans[0] else right_ans
+
+    # merge the halves' y-orders
+    idx1, idx2, pos = low, half, low
+    while idx1 < half and idx2 < top:
+        if ys[order[idx2]] < ys[order[idx1]]:
+            scratch[pos] = order[idx2]
+            idx2 += 1
+        else:
+            scratch[pos] = order[idx1]
+            idx1 += 1
+        pos += 1
+    while idx1 < half:
+        scratch[pos] = order[idx1]
+        idx1 += 1
+        pos += 1
+    while idx2 < top:
+        scratch[pos] = order[idx2]
+        idx2 += 1
+        pos += 1
+    for pos in range(low, top):
+        order[pos] = scratch[pos]
+
+    # points in the vertical strip, already sorted by y
+    mid = 0.5*(xs[half - 1] + xs[half])
+    count = low
+    for idx in range(low, top):
+        if abs(xs[order[idx]] - mid) <= ans[0]:
+            scratch[count] = order[idx]
+            count += 1
+
+    return scan_strip(xs, ys, scratch, low, count, ans)
+
+
+def scan_strip(xs, ys, strip, low, top, ans):
+    """
+    Improve ans, a (distance, idx1, idx2) triple, with the closest pair
+    among the point indices strip[low:top], which are sorted by y
+    """
+
+    for idx1 in range(low, top):
+        point1 = strip[idx1]
+        for idx2 in range(idx1 + 1, top):
+            point2 = strip[idx2]
+            vert_dist = ys[point2] - ys[point1]
+            if vert_dist >= ans[0]: # every later point is even farther
+                break
+            dist = vert_dist + abs(xs[point1] - xs[point2])
+            if dist < ans[0]:
+                ans = (dist, min(point1, point2), max(point1, point2))
+
+    return ans
 
 
 def closest_pair_strip(cluster_list, horiz_center, half_width):
     """
     Helper function to compute the closest pair of clusters in a vertical strip
     
-    Input: cluster_list is a list of clusters produced by fast_closest_pair
+    Input: cluster_list is a list of clusters
     horiz_center is the horizontal position of the strip's vertical center line
     half_width is the half the width of the strip (i.e, the maximum horizontal
     distance that a cluster can lie from the center line)
     """
-    
-    temp_list = []
-    for idx in range(len(cluster_list)):
-        if abs(cluster_list[idx].horiz_center() - horiz_center) <= half_width:
-            temp_list.append([cluster_list[idx], idx])
-    temp_list.sort(key = lambda item: item[0].vert_center()) # sort by vert_center
-    size = len(temp_list)
-    ans = (float('inf'), -1, -1)
-    for idx1 in range(size - 1):
-        temp_ans = (float('inf'), -1, -1)
-        for idx2 in range(idx1 + 1, min(idx1 + 4, size)):
-            temp = temp_list[idx1][0].distance(temp_list[idx2][0])
-            if temp < temp_ans[0]:
-                temp_ans = (temp, idx1, idx2)
-        if temp_ans[0] < ans[0]:
-            ans = temp_ans
-    if len(temp_list) > 0:
-        ind = [temp_list[ans[1]][1], temp_list[ans[2]][1]]
-    else:
-        return (float('inf'), -1, -1)
-    
-    return (ans[0], min(ind), max(ind))            
-        
+
+    xs = [cluster.horiz_center() for cluster in cluster_list]
+    ys = [cluster.vert_center() for cluster in cluster_list]
+    strip = [idx for idx in range(len(cluster_list)) if abs(xs[idx] - horiz_center) <= half_width]
+    strip.sort(key = lambda idx: ys[idx])
+
+    return scan_strip(xs, ys, strip, 0, len(strip), (float('inf'), -1, -1))
+
 #******************************************************************************
 # Code for hierarchical clustering
 #******************************************************************************
@@ -105,95 +168,241 @@ def hierarchical_clustering(cluster_list, num_clusters):
     """
     Compute a hierarchical clustering of a set of clusters
     Note: the function may mutate cluster_list
+
+    Every cluster keeps its nearest neighbor in a priority queue of
+    candidate pairs. Entries are invalidated lazily: a merge only recomputes
+    the neighbors of the merged cluster and of the clusters that pointed to
+    one of the two merged ones.
     """
-    
-    # sort by horiz_center
-    cluster_list.sort(key = lambda cluster: cluster.horiz_center()) 
-    while len(cluster_list) > num_clusters:
-        temp = fast_closest_pair(cluster_list)
-        clust2 = cluster_list.pop(temp[2])
-        clust1 = cluster_list.pop(temp[1])
-        clust1.merge_clusters(clust2)
-        binary_insert(cluster_list, clust1)
-    
+
+    clusters = list(cluster_list)
+    size = len(clusters)
+    xs = np.array([cluster.horiz_center() for cluster in clusters], dtype=float)
+    ys = np.array([cluster.vert_center() for cluster in clusters], dtype=float)
+    alive = np.ones(size, dtype=bool)
+    near = np.full(size, -1, dtype=np.intp) # nearest neighbor of each cluster
+    near_dist = np.full(size, float('inf'))
+    heap = []
+
+    def distances(idx):
+        """ Distances from cluster idx to every live cluster (inf to itself) """
+        dist = np.abs(ys - ys[idx]) + np.abs(xs - xs[idx])
+        dist[~alive] = float('inf')
+        dist[idx] = float('inf')
+        return dist
+
+    def update(idx, dist):
+        """ Point cluster idx to its nearest neighbor given its distances """
+        other = int(dist.argmin())
+        near[idx], near_dist[idx] = other, dist[other]
+        heapq.heappush(heap, (dist[other], idx, other))
+
+    if size > 1:
+        for idx in range(size):
+            update(idx, distances(idx))
+
+    with inst.phase('merge'):
+        live = size
+        while live > max(num_clusters, 1):
+            dist, idx1, idx2 = heapq.heappop(heap)
+            if not alive[idx1] or near[idx1] != idx2 or near_dist[idx1] != dist:
+                continue # stale entry
+            # merge into the cluster with the smaller horizontal center
+            if (xs[idx2], idx2) < (xs[idx1], idx1):
+                idx1, idx2 = idx2, idx1
+            clusters[idx1].merge_clusters(clusters[idx2])
+            alive[idx2] = False
+            live -= 1
+            xs[idx1], ys[idx1] = clusters[idx1].horiz_center(), clusters[idx1].vert_center()
+
+            # the merged cluster, and whoever pointed at one of the two
+            dist = distances(idx1)
+            update(idx1, dist)
+            for idx in np.flatnonzero(alive & ((near == idx1) | (near == idx2))):
+                if idx != idx1:
+                    update(idx, distances(idx))
+            # whoever is now closer to the merged cluster than to its neighbor
+            for idx in np.flatnonzero(dist < near_dist):
+                near[idx], near_dist[idx] = idx1, dist[idx]
+                heapq.heappush(heap, (dist[idx], idx, idx1))
+    inst.count('merges', size - live)
+
+    cluster_list[:] = sorted([clusters[idx] for idx in np.flatnonzero(alive)],
+                             key = lambda cluster: cluster.horiz_center())
+
     return cluster_list
-        
 
-def binary_insert(cluster_list, cluster):
-    """ 
-    Inserts cluster in cluster_list according to its horiz_center 
-    """
-    
-    top = len(cluster_list)
-    low = 0
-    if cluster.horiz_center() < cluster_list[0].horiz_center():
-        cluster_list.insert(0, cluster)
-        return       
-    while top != low + 1:
-        mid = (low + top) /2
-        if cluster.horiz_center() < cluster_list[mid].horiz_center():
-            top = mid
-        else:
-            low = mid            
-    cluster_list.insert(top, cluster)
-        
 
 #******************************************************************************
 # Code for k-means clustering
 #******************************************************************************
 
-def kmeans_clustering(cluster_list, num_clusters, num_iterations):
+def kmeans_clustering(cluster_list, num_clusters, num_iterations, stats=None,
+                      init='heaviest', seed=0, medians=False):
     """
     Compute the k-means clustering of a set of clusters
     Note: cluster_list does not mutate
+
+    Stops early once the clusters no longer change. If stats is a dict it
+    receives the iterations run, the distance evaluations done/skipped and
+    the final cost. init selects the seeding (see clustering_numpy.SEEDINGS),
+    seed the random seed of the randomized ones. medians moves the centers
+    to weighted medians (k-medians) instead of weighted means.
     """
 
-    ans = [] # this list to store clusters with highest weight (sorted)
-    cen = [] # this list to store the initial centers as tuples
-    temp = list(cluster_list)
-    temp.sort(key = lambda cluster: cluster.total_population())
-    temp.reverse()
-    for idx in range(num_clusters):
-        ans.append(temp[idx].copy())
-        cen.append((ans[idx].horiz_center(), ans[idx].vert_center()))
-   
-    for dummy_i in range(num_iterations):
-        clusters = [Cluster(set([]), cen[idx][0], cen[idx][1], 0, (0, 0)) for idx in range(num_clusters)]
-        for num in range(len(cluster_list)):
-            best = (float('inf'), -1)
-            for idx in range(num_clusters):
-                temp = cluster_list[num].distance(ans[idx])
-                if temp < best[0]:
-                    best = (temp, idx)
-            clusters[best[1]].merge_clusters(cluster_list[num])
-        for idx in range(num_clusters):
-            ans[idx] = clusters[idx].copy()
-            cen[idx] = (clusters[idx].horiz_center(), clusters[idx].vert_center())
-    
-    return ans
+    return kmeans_labels(cluster_list, num_clusters, num_iterations, stats,
+                         init, seed, medians).to_clusters()
+
+
+def kmeans_labels(cluster_list, num_clusters, num_iterations, stats=None,
+                  init='heaviest', seed=0, medians=False):
+    """
+    Same as kmeans_clustering, but return the result as a Clustering of
+    cluster_list, one label per cluster. With no iterations only the seeds
+    are clustered, one per group.
+    """
+
+    arrays = cluster_arrays(cluster_list)
+    xs, ys, ws, cxs, cys = arrays
+    seeds = seed_indices(xs, ys, ws, num_clusters, init, np.random.default_rng(seed))
+    if num_iterations == 0:
+        labels = np.full(len(cluster_list), -1, dtype=np.intp)
+        labels[seeds] = np.arange(len(seeds))
+        clustering = label_clustering(cluster_list, labels, len(seeds), arrays=arrays)
+        if stats is not None:
+            stats.update(iterations=0, distance_evaluations=0, distance_skipped=0,
+                         cost=clustering.cost())
+        return clustering
+
+    centers = np.column_stack((xs[seeds], ys[seeds]))
+    labels, centers, weights, corners = kmeans_arrays(xs, ys, ws, num_clusters,
+                                                      num_iterations, cxs, cys,
+                                                      stats=stats, centers=centers,
+                                                      medians=medians)
+
+    return label_clustering(cluster_list, labels, len(centers),
+                            (centers, weights, corners), arrays)
+
+
+def csp_labels(cluster_list, num_clusters, num_iterations, stats=None, init='heaviest', seed=0):
+    """
+    Like kmeans_labels, but iterating on the CSP cost itself (see
+    clustering_numpy.csp_lloyd) instead of the distances to the centers
+    """
+
+    arrays = cluster_arrays(cluster_list)
+    xs, ys, ws, cxs, cys = arrays
+    seeds = seed_indices(xs, ys, ws, num_clusters, init, np.random.default_rng(seed))
+    centers = np.column_stack((xs[seeds], ys[seeds]))
+    labels, centers, weights, corners = csp_lloyd(xs, ys, ws, num_clusters, num_iterations,
+                                                  cxs, cys, stats=stats, centers=centers)
+
+    return label_clustering(cluster_list, labels, len(centers),
+                            (centers, weights, corners), arrays)
+
+
+def kmeans_restarts(cluster_list, num_clusters, num_iterations, restarts, init='kmeans++',
+                    seed=0, workers=1, budget=None, stats=None, medians=False):
+    """
+    Multi-start k-means as a Clustering of cluster_list: the best of
+    restarts seedings by CSP cost after closestCorner reassignment (see
+    clustering_numpy.multistart_kmeans for init, seed, workers, budget and
+    medians)
+    """
+
+    arrays = cluster_arrays(cluster_list)
+    xs, ys, ws, cxs, cys = arrays
+    labels, centers, weights, corners = multistart_kmeans(xs, ys, ws, num_clusters,
+                                                          num_iterations, restarts,
+                                                          cxs, cys, init, seed,
+                                                          workers, budget, stats, medians)
+
+    return label_clustering(cluster_list, labels, num_clusters,
+                            (centers, weights, corners), arrays)
+
+
+def corner_labels(singletons, corners):
+    """
+    Label points with their closest dominant corner, as a Clustering of
+    singletons (-1 for points no corner dominates)
+    """
+
+    arrays = cluster_arrays(singletons)
+    with inst.phase('reassign'):
+        labels = DominanceIndex(corners).query(arrays[0], arrays[1])[0]
+
+    return label_clustering(singletons, labels, len(corners), arrays=arrays)
+
+
+def refine_labels(singletons, corners, budget=None, patience=None, stats=None):
+    """
+    Improve the corners by local search (see refine_corners) for at most
+    budget seconds, then label points with their closest dominant corner
+    """
+
+    arrays = cluster_arrays(singletons)
+    corners = refine_corners(arrays[0], arrays[1], arrays[2], corners, budget, patience,
+                             stats=stats)
+    with inst.phase('reassign'):
+        labels = DominanceIndex(corners).query(arrays[0], arrays[1])[0]
+
+    return label_clustering(singletons, labels, len(corners), arrays=arrays)
+
+
+def label_clustering(cluster_list, labels, num_clusters, aggregates=None, arrays=None):
+    """
+    Clustering of cluster_list given one label per cluster (-1 for none).
+    aggregates are the groups' (centers, weights, corners), computed from
+    the labels if not given; arrays are cluster_arrays(cluster_list).
+    """
+
+    if arrays is None:
+        arrays = cluster_arrays(cluster_list)
+    ids = [cluster.fips_codes() for cluster in cluster_list]
+    if aggregates is None:
+        return Clustering.from_labels(ids, arrays, labels, num_clusters)
+
+    return Clustering(ids, arrays, labels, *aggregates)
 
 
 def closestCorner(singletons, corners):
     """ Cluster points with respect to closest dominant corner """
 
-    # initialize new clusters
-    clusters = [Cluster(set([]), 0, 0, 0, (0, 0)) for corner in corners] 
-     
-    count = 0   
-    for point in singletons:
-        best = (float('inf'), (0, 0))
-        for corner in corners:
-            # measure distance from point to corner
-            dist = abs(corner[0]-point.horiz_center()) + abs(corner[1]-point.vert_center())
-            # verify that corner dominates point
-            if point.horiz_center()<= corner[0] and point.vert_center() <= corner[1]:
-                if dist < best[0]:
-                    best = (dist, corner)
-
-        if best[1] != (0, 0): # feasibility sanity check
-            count += 1 # keep track of how many points were clustered
-            idx = corners.index(best[1])
-            clusters[idx].merge_clusters(point)
-
-    return clusters, count 
-    
\ No newline at end of file
+    clustering = corner_labels(singletons, corners)
+    count = clustering.count() # how many points were clustered
+
+    return clustering.to_clusters(), count 
+
+
+#******************************************************************************
+# Coreset compression
+#******************************************************************************
+
+def coreset_clusters(cluster_list, cells):
+    """
+    Weighted grid coreset of cluster_list (see clustering_coreset.grid_coreset):
+    one merged Cluster per nonempty grid cell, holding its members' ID's.
+
+    Returns (representatives, mapping, distortion), mapping[i] being the
+    index of the representative of cluster_list[i]
+    """
+
+    arrays = cluster_arrays(cluster_list)
+    xs, ys, ws, cxs, cys = arrays
+    mapping, reps, distortion = grid_coreset(xs, ys, ws, cells, cxs, cys)
+    clustering = label_clustering(cluster_list, mapping, len(reps[0]), arrays=arrays)
+
+    return clustering.to_clusters(), mapping, distortion
+
+
+def map_back(clustering, cluster_list, mapping):
+    """
+    Clustering of the original cluster_list from a clustering of its
+    coreset representatives: every point takes its representative's label
+    and the clusters keep their centers, weights and corners
+    """
+
+    labels = clustering.labels()[mapping]
+    aggregates = (clustering.centers(), clustering.weights(), clustering.corners())
+
+    return label_clustering(cluster_list, labels, len(clustering), aggregates)
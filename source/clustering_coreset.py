@@ -0,0 +1,55 @@
+"""
+Weighted grid coresets: the points snapped to a grid, one representative
+per occupied cell, so the solvers can run on far fewer points.
+"""
+
+import numpy as np
+from clustering_numpy import group_centers, group_corners, group_weights
+
+
+def grid_coreset(xs, ys, ws, cells, cxs=None, cys=None):
+    """
+    Compress weighted points by snapping them to a cells x cells grid over
+    their bounding box. Every nonempty cell becomes one representative
+    carrying the cell's total weight, weighted center and upper right
+    corner (the max of its points' corners), so any container dominating
+    a representative dominates all the points it stands for.
+
+    Output: (mapping, arrays, distortion). mapping[i] is the representative
+    of point i, arrays are the representatives' (xs, ys, ws, cxs, cys) and
+    distortion is the measured bound W*(dx + dy) / LB, where dx, dy are
+    the largest corner spreads inside a cell, W the total weight and LB
+    the lower bound sum of w*(cx + cy). Moving every corner of an optimal
+    solution by (dx, dy) makes it cover the representatives, so the
+    coreset optimum is at most (1 + distortion) times the true optimum,
+    and a coreset solution costs no more on the original points.
+    """
+
+    if cxs is None:
+        cxs, cys = xs, ys
+    if len(xs) == 0:
+        empty = np.empty(0)
+        return np.empty(0, dtype=np.intp), (empty, empty, empty, empty, empty), 0.0
+
+    def snap(values):
+        low, high = values.min(), values.max()
+        width = (high - low) / cells if high > low else 1.0
+        return np.minimum(((values - low) / width).astype(np.intp), cells - 1)
+
+    cell_ids, mapping = np.unique(snap(xs) * cells + snap(ys), return_inverse=True)
+    mapping = mapping.reshape(-1)
+    size = len(cell_ids)
+    ws = np.asarray(ws)
+    centers = group_centers(mapping, xs, ys, ws, size, np.zeros((size, 2)))
+    corners = group_corners(mapping, cxs, cys, size)
+    lows = np.full((size, 2), np.inf)
+    np.minimum.at(lows[:, 0], mapping, cxs)
+    np.minimum.at(lows[:, 1], mapping, cys)
+    spread = (corners - lows).max(axis=0)
+
+    lower_bound = np.dot(ws, cxs + cys)
+    distortion = ws.sum() * spread.sum() / lower_bound if lower_bound > 0 else 0.0
+    arrays = (centers[:, 0], centers[:, 1], group_weights(mapping, ws, size),
+              corners[:, 0], corners[:, 1])
+
+    return mapping, arrays, float(distortion)
@@ -0,0 +1,174 @@
+"""
+Local search over the corners of a CSP solution: each corner in turn is
+shrunk or moved to a grid position, keeping the move that lowers the cost
+most.
+"""
+
+import instrumentation as inst
+import numpy as np
+import time
+from DominanceIndex import DominanceIndex
+
+# largest number of candidate/point pairs scored at once by a move
+MOVE_BLOCK = 1 << 21
+
+def corner_grid(xs, ys, grid):
+    """
+    Candidate corner positions: the grid of the points' x and y coordinates
+    at grid evenly spaced ranks, as a (grid**2, 2) array
+    """
+
+    ux, uy = np.unique(xs), np.unique(ys)
+    gx = ux[np.unique(np.linspace(0, len(ux) - 1, grid).round().astype(np.intp))]
+    gy = uy[np.unique(np.linspace(0, len(uy) - 1, grid).round().astype(np.intp))]
+
+    return np.column_stack((np.repeat(gx, len(gy)), np.tile(gy, len(gx))))
+
+
+def corner_costs(xs, ys, corners):
+    """
+    (first, b1, second, b2) of every point: its cheapest and second cheapest
+    dominating corner and their x + y (index -1 and inf if there is none)
+    """
+
+    keys = corners.sum(axis=1)
+    cost = np.where((corners[:, 0, None] >= xs) & (corners[:, 1, None] >= ys),
+                    keys[:, None], np.inf)
+    cost = np.vstack((cost, np.full((2, len(xs)), np.inf))) # padding for k < 2
+    order = np.argsort(cost, axis=0, kind='stable')[:2]
+    rows = np.arange(len(xs))
+    first, second = order[0], order[1]
+    b1, b2 = cost[first, rows], cost[second, rows]
+    first[np.isinf(b1)] = -1
+    second[np.isinf(b2)] = -1
+
+    return first, b1, second, b2
+
+
+def move_deltas(xs, ys, ws, state, idx, cand):
+    """
+    Change of sum(w*b1) when corner idx is replaced by each of the candidate
+    corners cand (inf when some point would be left uncovered). Only the
+    points of corner idx and those that pay more than a candidate's x + y
+    are scored.
+    """
+
+    first, b1, second, b2 = state
+    keys = cand.sum(axis=1)
+    order = np.argsort(keys, kind='stable')
+    deltas = np.empty(len(cand))
+
+    own = np.nonzero(first == idx)[0]
+    ox, oy, ow, o1, o2 = xs[own], ys[own], ws[own], b1[own], b2[own]
+    rest = np.nonzero(first != idx)[0]
+    rest = rest[np.argsort(-b1[rest], kind='stable')] # most expensive first
+    rx, ry, rw, r1 = xs[rest], ys[rest], ws[rest], b1[rest]
+
+    rows = max(1, MOVE_BLOCK // max(1, len(xs)))
+    for lo in range(0, len(cand), rows):
+        block = order[lo:lo + rows]
+        c, k = cand[block], keys[block]
+        # points of idx move to the candidate or to their second corner
+        dom = (c[:, 0, None] >= ox) & (c[:, 1, None] >= oy)
+        new = np.minimum(o2, np.where(dom, k[:, None], np.inf))
+        uncovered = np.isinf(new).any(axis=1)
+        new[uncovered] = o1 # scored as inf below, keeps inf*0 out of the dot
+        lost = (new - o1).dot(ow)
+        lost[uncovered] = np.inf
+        # other points only move to a cheaper candidate
+        top = int(np.count_nonzero(r1 > k.min()))
+        dom = (c[:, 0, None] >= rx[:top]) & (c[:, 1, None] >= ry[:top])
+        saved = np.maximum(r1[:top] - k[:, None], 0)
+        gained = np.where(dom, saved, 0).dot(rw[:top])
+        deltas[block] = lost - gained
+
+    return deltas
+
+
+def shrink_moves(xs, ys, members):
+    """
+    Corners shrinking a cluster: its tight corner and the corners pulling
+    its right or its top side in past the points on it
+    """
+
+    mx, my = xs[members], ys[members]
+    top_x, top_y = mx.max(), my.max()
+    moves = [(top_x, top_y)]
+    if (mx < top_x).any():
+        moves.append((mx[mx < top_x].max(), top_y))
+    if (my < top_y).any():
+        moves.append((top_x, my[my < top_y].max()))
+
+    return np.array(moves, dtype=float)
+
+
+def corner_search(xs, ys, ws, corners, grid=32, patience=None):
+    """
+    Local search over the corners of a CSP solution, minimizing the cost
+    sum(w*(x + y)) of every point's cheapest dominating corner.
+
+    Visits the corners in turn; for each one it tries shrinking it (see
+    shrink_moves) and relocating it to any position of the corner_grid,
+    scoring the moves with move_deltas, and applies the best one if it
+    lowers the cost. Only the points the applied move touches are updated.
+    Yields (cost, corners, improved) after every visit, so the caller can
+    stop at any time with the best solution so far; stops by itself after
+    patience visits without improvement (default: one full round, a local
+    optimum). Points no corner dominates are left out.
+    """
+
+    corners = np.array(corners, dtype=float).reshape(-1, 2)
+    covered = ~DominanceIndex(corners).query(xs, ys)[1]
+    xs, ys, ws = xs[covered], ys[covered], np.asarray(ws, dtype=float)[covered]
+    pool = corner_grid(xs, ys, grid)
+    state = corner_costs(xs, ys, corners)
+    cost = float(np.dot(ws, state[1]))
+    patience = patience or len(corners)
+
+    idle = idx = 0
+    while idle < patience and len(xs):
+        members = state[0] == idx
+        cand = pool
+        if members.any():
+            cand = np.vstack((shrink_moves(xs, ys, members), pool))
+        deltas = move_deltas(xs, ys, ws, state, idx, cand)
+        inst.count('moves', len(cand))
+        best = int(np.argmin(deltas))
+        improved = deltas[best] < -1e-12 * cost
+        if improved:
+            # update the points that used corner idx or that the new one serves
+            corners[idx] = cand[best]
+            touched = ((state[0] == idx) | (state[2] == idx) |
+                       ((cand[best, 0] >= xs) & (cand[best, 1] >= ys)))
+            update = corner_costs(xs[touched], ys[touched], corners)
+            for field, values in zip(state, update):
+                field[touched] = values
+            cost = float(np.dot(ws, state[1]))
+            idle = 0
+        else:
+            idle += 1
+        yield cost, corners.copy(), improved
+        idx = (idx + 1) % len(corners)
+
+
+def refine_corners(xs, ys, ws, corners, budget=None, patience=None, grid=32, stats=None):
+    """
+    Run corner_search until it stops or budget seconds have passed.
+    Returns the best corners found; stats, if given, gets the cost,
+    the number of corner visits and of improving moves.
+    """
+
+    deadline = None if budget is None else time.perf_counter() + budget
+    best = np.array(corners, dtype=float).reshape(-1, 2)
+    visits = improvements = 0
+    cost = None
+    with inst.phase('search'):
+        for cost, best, improved in corner_search(xs, ys, ws, best, grid, patience):
+            visits += 1
+            improvements += int(improved)
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+    if stats is not None:
+        stats.update(cost=cost, visits=visits, improvements=improvements)
+
+    return best
@@ -7,7 +7,14 @@ Stony Brook University, NY, February 2016.
 """
 
 import math
+import os
 import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+from Clustering import Clustering
+import instrumentation as inst
 
 __author__ = 'Luay Nakhleh, Scott Rixner, Joe Warren'
 
@@ -26,58 +33,112 @@ def circle_area(pop):
 	return math.pi * pop / (200.0 ** 2)
 
 
-def plot_clusters(data_table, cluster_list, fs = 10, weights_on = True):
+def plot_clusters(data_table, cluster_list, fs = 10, weights_on = True,
+				  filename = None, max_points = None, seed = 0):
 	"""
-	Create a plot of clusters of data points
+	Create a plot of clusters of data points. cluster_list is either a list
+	of Cluster or a Clustering of the data table's points. With a filename
+	the figure is rendered off screen and saved, its format (png, svg, pdf,
+	...) taken from the extension; otherwise it is shown. With max_points,
+	larger data sets are drawn from a random sample of that many points
+	(centers and bounding boxes are always exact).
 	"""
 
-	fips_to_line = {}
-	for line_idx in range(len(data_table)):
-		fips_to_line[data_table[line_idx][0]] = line_idx
-	 
+	with inst.phase('plot'):
+		if filename is None:
+			figure = plt.figure()
+		else:
+			figure = Figure()
+			FigureCanvasAgg(figure)
+		draw_clusters(figure, data_table, cluster_list, fs, weights_on, max_points, seed)
+		if filename is not None:
+			figure.savefig(filename)
+	if filename is None:
+		plt.show()
+
+
+def sample_points(labels, max_points, seed):
+	"""
+	Mask of the clustered points to draw: all of them, or a uniform random
+	sample of max_points of them
+	"""
+	member = labels >= 0
+	count = int(np.count_nonzero(member))
+	if max_points is None or count <= max_points:
+		return member
+	chosen = np.random.default_rng(seed).choice(np.nonzero(member)[0], max_points, replace = False)
+	sample = np.zeros(len(labels), dtype = bool)
+	sample[chosen] = True
+	return sample
+
+
+def draw_clusters(figure, data_table, cluster_list, fs, weights_on, max_points, seed):
+	"""
+	Draw the clusters on a figure: one line collection and one scatter per
+	cluster, so the number of artists does not grow with the points
+	"""
+
+	clustering = cluster_list
+	if not isinstance(clustering, Clustering):
+		clustering = Clustering.from_clusters(data_table, cluster_list)
+	xs, ys, ws = clustering.arrays()[:3]
+	labels = clustering.labels()
+	centers = clustering.centers()
+	corners = clustering.corners()
+	shown = sample_points(labels, max_points, seed)
+
 	# Scale plot 
-	x_range = max([cluster._corner[0] for cluster in cluster_list])
-	y_range = max([cluster._corner[1] for cluster in cluster_list])
-	plt.figure(figsize=(fs, int(fs*float(y_range) / x_range))) # adjust image size
-	axes = plt.gca() # set plot's x and y ranges
+	x_range = corners[:, 0].max()
+	y_range = corners[:, 1].max()
+	figure.set_size_inches(fs, int(fs*float(y_range) / x_range)) # adjust image size
+	axes = figure.add_subplot(111) # set plot's x and y ranges
 	axes.set_xlim([0,1 + int(1.05*x_range)])
 	axes.set_ylim([0,1 + int(1.05*y_range)])
-   
-	# plotting visualization lines
-	for cluster_idx in range(len(cluster_list)):
-		cluster = cluster_list[cluster_idx]
-		cluster_color = COLORS[cluster_idx % len(COLORS)]
-		cluster_center = (cluster.horiz_center(), cluster.vert_center())
-		for fips_code in cluster.fips_codes():
-			line = data_table[fips_to_line[fips_code]]
-			plt.plot( [cluster_center[0], line[1]],[cluster_center[1], line[2]], cluster_color, lw=1, zorder = 2)
-
-	# plotting data points
-	for cluster_idx in range(len(cluster_list)):
-		cluster = cluster_list[cluster_idx]
+
+	for cluster_idx in range(len(clustering)):
 		cluster_color = COLORS[cluster_idx % len(COLORS)]
-		for fips_code in cluster.fips_codes():
-			line = data_table[fips_to_line[fips_code]]
-			size = 5
-			if weights_on: # if dots are to be drawn according to their weight
-				size = circle_area(line[3])
-			plt.scatter(x = [line[1]], y = [line[2]], s = size, lw = 1,
-						facecolors = cluster_color, edgecolors = cluster_color, zorder = 1)
-		
+		points = np.nonzero(shown & (labels == cluster_idx))[0]
+		center = centers[cluster_idx]
+		c = corners[cluster_idx]
+
+		# visualization lines, data points and bounding box
+		segments = np.empty((len(points), 2, 2))
+		segments[:, 0] = center
+		segments[:, 1, 0] = xs[points]
+		segments[:, 1, 1] = ys[points]
+		axes.add_collection(LineCollection(segments, colors = cluster_color, lw = 1, zorder = 2))
+		size = 5
+		if weights_on: # if dots are to be drawn according to their weight
+			size = circle_area(ws[points])
+		axes.scatter(xs[points], ys[points], s = size, lw = 1,
+					 facecolors = cluster_color, edgecolors = cluster_color, zorder = 1)
+		axes.plot([c[0], c[0], 0], [0, c[1], c[1]], cluster_color, lw = 1, zorder = 3)
+
 	# plotting cluster centroids
-	for cluster_idx in range(len(cluster_list)):
-		cluster = cluster_list[cluster_idx]
-		cluster_color = COLORS[cluster_idx % len(COLORS)]
-		cluster_center = (cluster.horiz_center(), cluster.vert_center())
-		
-		plt.scatter(x = [cluster_center[0]], y = [cluster_center[1]], s =  10, lw = 1,
-					facecolors = "black", edgecolors = "black", zorder = 4)
-
-	# plotting bounding boxes 
-	for cluster_idx in range(len(cluster_list)):
-		cluster_color = COLORS[cluster_idx % len(COLORS)] 
-		c = cluster_list[cluster_idx]
-		plt.plot( [c._corner[0], c._corner[0]], [0, c._corner[1]], cluster_color, lw=1, zorder = 3)
-		plt.plot( [0, c._corner[0]], [c._corner[1], c._corner[1]], cluster_color, lw=1, zorder = 3)
-  
-	plt.show()
+	axes.scatter(centers[:, 0], centers[:, 1], s = 10, lw = 1,
+				 facecolors = "black", edgecolors = "black", zorder = 4)
+
+
+def add_arguments(parser):
+	"""
+	Add the --plot-dir, --plot-format and --max-points options to an
+	argparse parser
+	"""
+	parser.add_argument('--plot-dir', default = None, metavar = 'DIR',
+						help = 'save the plots in DIR instead of showing them')
+	parser.add_argument('--plot-format', default = 'png', choices = ['png', 'svg', 'pdf'],
+						help = 'file format of the saved plots')
+	parser.add_argument('--max-points', type = int, default = None, metavar = 'N',
+						help = 'draw at most N randomly sampled points per plot')
+
+
+def plot_options(args, name):
+	"""
+	Keyword arguments of plot_clusters for the plot called name, as asked
+	by the options of add_arguments
+	"""
+	filename = None
+	if args.plot_dir is not None:
+		os.makedirs(args.plot_dir, exist_ok = True)
+		filename = os.path.join(args.plot_dir, name + '.' + args.plot_format)
+	return {'filename': filename, 'max_points': args.max_points}
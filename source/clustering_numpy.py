@@ -0,0 +1,716 @@
+"""
+Array backend for the clustering algorithms. Points are kept as NumPy arrays
+of coordinates, weights and corners instead of lists of Cluster objects, so
+that each k-means iteration is a handful of vectorized passes.
+"""
+
+import multiprocessing
+import numpy as np
+import time
+from DominanceIndex import DominanceIndex
+import instrumentation as inst
+
+# number of points per block when computing point to center distances, this
+# bounds the size of the temporary n x k distance matrix
+CHUNK_SIZE = 65536
+
+#******************************************************************************
+# Conversion helpers
+#******************************************************************************
+
+def cluster_arrays(cluster_list):
+    """
+    Build the arrays (xs, ys, ws, cxs, cys) of centers, weights and corners
+    of a list of clusters
+    """
+
+    size = len(cluster_list)
+    xs = np.fromiter((cluster.horiz_center() for cluster in cluster_list), float, size)
+    ys = np.fromiter((cluster.vert_center() for cluster in cluster_list), float, size)
+    ws = np.array([cluster.total_population() for cluster in cluster_list])
+    cxs = np.fromiter((cluster.corner()[0] for cluster in cluster_list), float, size)
+    cys = np.fromiter((cluster.corner()[1] for cluster in cluster_list), float, size)
+
+    return xs, ys, ws, cxs, cys
+
+
+def heaviest_seeds(ws, num_clusters):
+    """
+    Indices of the num_clusters heaviest points. Ties are broken as in the
+    original sort-and-reverse: the later point comes first.
+    """
+
+    return np.argsort(ws, kind='stable')[::-1][:num_clusters]
+
+
+def random_seeds(ws, num_clusters, rng):
+    """ Indices of num_clusters distinct points drawn uniformly at random """
+
+    return rng.choice(len(ws), size=min(num_clusters, len(ws)), replace=False)
+
+
+def draw_index(mass, rng):
+    """ Index drawn with probability proportional to the array mass """
+
+    cumulative = np.cumsum(mass)
+    idx = np.searchsorted(cumulative, rng.random() * cumulative[-1], side='right')
+
+    return min(int(idx), len(mass) - 1)
+
+
+def kmeanspp_seeds(xs, ys, ws, num_clusters, rng, power=2):
+    """
+    Weighted k-means++ seeding under the manhattan distance. The first seed
+    is drawn with probability proportional to its weight, every next one
+    proportional to w*d**power (D2 with power 2, D1 with power 1), d the
+    distance to the closest seed so far. Once every point is at distance 0
+    (or weightless) the rest are drawn uniformly among the points not
+    chosen yet.
+    """
+
+    ws = np.asarray(ws, dtype=float)
+    size = min(num_clusters, len(xs))
+    chosen = np.zeros(len(xs), dtype=bool)
+    dist = np.full(len(xs), np.inf)
+    seeds = []
+    for dummy_idx in range(size):
+        mass = ws if not seeds else ws * dist ** power
+        if mass.sum() > 0:
+            seed = draw_index(mass, rng)
+        else:
+            seed = int(rng.choice(np.flatnonzero(~chosen)))
+        seeds.append(seed)
+        chosen[seed] = True
+        dist = np.minimum(dist, np.abs(xs - xs[seed]) + np.abs(ys - ys[seed]))
+
+    return np.array(seeds, dtype=np.intp)
+
+
+# k-means seeding methods accepted by seed_indices
+SEEDINGS = ['heaviest', 'random', 'kmeans++', 'kmeans++d1']
+
+def seed_indices(xs, ys, ws, num_clusters, init='heaviest', rng=None):
+    """
+    Indices of the initial k-means centers: the heaviest points
+    ('heaviest'), random points ('random') or weighted k-means++ seeds with
+    D2 ('kmeans++') or D1 ('kmeans++d1') sampling. rng is a numpy
+    Generator, needed by the randomized methods.
+    """
+
+    with inst.phase('seed'):
+        if init == 'heaviest':
+            return heaviest_seeds(ws, num_clusters)
+        elif init == 'random':
+            return random_seeds(ws, num_clusters, rng)
+        elif init == 'kmeans++':
+            return kmeanspp_seeds(xs, ys, ws, num_clusters, rng)
+        elif init == 'kmeans++d1':
+            return kmeanspp_seeds(xs, ys, ws, num_clusters, rng, power=1)
+    raise ValueError("unknown k-means seeding method: %r" % (init,))
+
+
+def seed_centers(xs, ys, ws, num_clusters, init='heaviest', rng=None):
+    """ Initial (num_clusters, 2) k-means centers, see seed_indices """
+
+    seeds = seed_indices(xs, ys, ws, num_clusters, init, rng)
+
+    return np.column_stack((xs[seeds], ys[seeds]))
+
+#******************************************************************************
+# Batched assignment and weighted reductions
+#******************************************************************************
+
+def nearest_centers(xs, ys, centers, chunk_size=CHUNK_SIZE):
+    """
+    Label every point with the index of its closest center (manhattan).
+    Ties go to the lowest center index.
+    """
+
+    labels = np.empty(len(xs), dtype=np.intp)
+    hcs = centers[:, 0]
+    vcs = centers[:, 1]
+    for start in range(0, len(xs), chunk_size):
+        stop = start + chunk_size
+        dist = np.abs(ys[start:stop, None] - vcs) + np.abs(xs[start:stop, None] - hcs)
+        labels[start:stop] = dist.argmin(axis=1)
+
+    return labels
+
+
+def group_weights(labels, ws, num_clusters):
+    """ Total weight of every group, with the dtype of ws """
+
+    weights = np.bincount(labels, weights=ws, minlength=num_clusters)
+    if ws.dtype.kind in 'iu':
+        weights = np.rint(weights).astype(ws.dtype)
+
+    return weights
+
+
+def group_centers(labels, xs, ys, ws, num_clusters, centers):
+    """
+    Weighted centers of every group. Empty (or weightless) groups keep the
+    center they had in centers.
+    """
+
+    weight = np.bincount(labels, weights=ws, minlength=num_clusters)
+    sum_x = np.bincount(labels, weights=ws*xs, minlength=num_clusters)
+    sum_y = np.bincount(labels, weights=ws*ys, minlength=num_clusters)
+    new_centers = np.array(centers, dtype=float)
+    nonempty = weight > 0
+    new_centers[nonempty, 0] = sum_x[nonempty] / weight[nonempty]
+    new_centers[nonempty, 1] = sum_y[nonempty] / weight[nonempty]
+
+    return new_centers
+
+
+def weighted_median(values, weights):
+    """
+    Lower weighted median of values, the smallest v holding at least half
+    the weight at or below it, which minimizes sum(w*|value - v|). Found by
+    selection around the unweighted median, halving the values every round,
+    so in linear time.
+    """
+
+    half = weights.sum() / 2.0
+    while len(values) > 1:
+        pivot = np.partition(values, len(values) // 2)[len(values) // 2]
+        below = values < pivot
+        above = values > pivot
+        w_below = weights[below].sum()
+        if w_below >= half and below.any():
+            values, weights = values[below], weights[below]
+        elif w_below + weights[~below & ~above].sum() >= half or not above.any():
+            return pivot
+        else:
+            half -= weights[~above].sum()
+            values, weights = values[above], weights[above]
+
+    return values[0]
+
+
+def group_medians(labels, xs, ys, ws, num_clusters, centers):
+    """
+    Per coordinate weighted medians of every group, the centers minimizing
+    the groups' weighted manhattan distances. Empty groups keep the center
+    they had in centers.
+    """
+
+    # a counting sort for up to 2**15 groups
+    key = labels.astype(np.int16) if num_clusters < 1 << 15 else labels
+    order = np.argsort(key, kind='stable')
+    bounds = np.concatenate(([0], np.cumsum(np.bincount(labels, minlength=num_clusters))))
+    sorted_x, sorted_y, sorted_w = xs[order], ys[order], ws[order]
+    new_centers = np.array(centers, dtype=float)
+    for idx in range(num_clusters):
+        lo, hi = bounds[idx], bounds[idx + 1]
+        if lo < hi and sorted_w[lo:hi].sum() > 0:
+            new_centers[idx] = (weighted_median(sorted_x[lo:hi], sorted_w[lo:hi]),
+                                weighted_median(sorted_y[lo:hi], sorted_w[lo:hi]))
+
+    return new_centers
+
+
+def group_corners(labels, cxs, cys, num_clusters):
+    """
+    Upper right corner of every group, the coordinate-wise max of its
+    members' corners. Empty groups get corner (0, 0).
+    """
+
+    corners = np.zeros((num_clusters, 2))
+    np.maximum.at(corners[:, 0], labels, cxs)
+    np.maximum.at(corners[:, 1], labels, cys)
+
+    return corners
+
+#******************************************************************************
+# Code for k-means clustering
+#******************************************************************************
+
+def point_distances(xs, ys, centers, chunk_size=CHUNK_SIZE):
+    """ Matrix of manhattan distances from every point to every center """
+
+    dist = np.empty((len(xs), len(centers)))
+    for start in range(0, len(xs), chunk_size):
+        stop = start + chunk_size
+        dist[start:stop] = (np.abs(ys[start:stop, None] - centers[:, 1]) +
+                            np.abs(xs[start:stop, None] - centers[:, 0]))
+
+    return dist
+
+
+def center_separation(centers):
+    """ Half the distance from every center to its closest other center """
+
+    if len(centers) < 2:
+        return np.full(len(centers), np.inf)
+    dist = point_distances(centers[:, 0], centers[:, 1], centers)
+    np.fill_diagonal(dist, np.inf)
+
+    return 0.5 * dist.min(axis=1)
+
+
+def initial_bounds(xs, ys, centers, chunk_size=CHUNK_SIZE):
+    """
+    Full assignment that starts the Hamerly bounds: returns the labels (as
+    nearest_centers), the distance from every point to its center and to
+    its second closest one (inf with a single center).
+    """
+
+    labels = np.empty(len(xs), dtype=np.intp)
+    upper = np.empty(len(xs))
+    lower = np.full(len(xs), np.inf)
+    for start in range(0, len(xs), chunk_size):
+        stop = start + chunk_size
+        dist = point_distances(xs[start:stop], ys[start:stop], centers)
+        labels[start:stop] = dist.argmin(axis=1)
+        upper[start:stop] = dist[np.arange(len(dist)), labels[start:stop]]
+        if len(centers) > 1:
+            lower[start:stop] = np.partition(dist, 1, axis=1)[:, 1]
+
+    return labels, upper, lower
+
+
+def bounded_assignment(xs, ys, centers, labels, upper, lower):
+    """
+    One Hamerly assignment step. upper[i] bounds the distance from point i
+    to its center from above and lower[i] the distance to any other center
+    from below; a point whose upper bound is strictly below both lower[i]
+    and half the gap from its center to the closest other center cannot
+    change cluster. Only the others are measured: first against their own
+    center, then, if that is not enough, against all of them.
+
+    Mutates labels, upper and lower; returns the number of distances computed.
+    """
+
+    limit = np.maximum(center_separation(centers)[labels], lower)
+    check = np.flatnonzero(upper >= limit)
+    own = centers[labels[check]]
+    upper[check] = np.abs(ys[check] - own[:, 1]) + np.abs(xs[check] - own[:, 0])
+    full = check[upper[check] >= limit[check]]
+    if len(full) > 0:
+        dist = point_distances(xs[full], ys[full], centers)
+        labels[full] = dist.argmin(axis=1)
+        upper[full] = dist[np.arange(len(full)), labels[full]]
+        if len(centers) > 1:
+            lower[full] = np.partition(dist, 1, axis=1)[:, 1]
+
+    return len(check) + len(full) * len(centers)
+
+
+def kmeans_arrays(xs, ys, ws, num_clusters, num_iterations, cxs=None, cys=None,
+                  accelerated=True, stats=None, centers=None, medians=False):
+    """
+    k-means of weighted points from the given initial centers (default: the
+    heaviest points), stopping once no point changes cluster. cxs, cys are
+    the points' corners; accelerated skips distances with Hamerly bounds,
+    medians uses weighted medians (k-medians). Returns (labels, centers,
+    weights, corners); stats gets iterations, distance counts and cost.
+    """
+
+    if cxs is None:
+        cxs, cys = xs, ys
+    if centers is None:
+        centers = seed_centers(xs, ys, ws, num_clusters)
+    centers = np.array(centers, dtype=float)
+    num_clusters = len(centers) # fewer seeds than clusters if points run out
+    labels = np.zeros(len(xs), dtype=np.intp)
+    # keep the bounds safe from rounding in the drift updates
+    slack = 1e-12
+
+    evaluations = 0
+    iterations = 0
+    for dummy_i in range(num_iterations):
+        previous = labels.copy()
+        with inst.phase('assign'):
+            if accelerated and iterations == 0:
+                labels, upper, lower = initial_bounds(xs, ys, centers)
+                evaluations += len(xs) * num_clusters
+            elif accelerated:
+                evaluations += bounded_assignment(xs, ys, centers, labels, upper, lower)
+            else:
+                labels = nearest_centers(xs, ys, centers)
+                evaluations += len(xs) * num_clusters
+        iterations += 1
+        if iterations > 1 and np.array_equal(labels, previous):
+            break
+        with inst.phase('update'):
+            update = group_medians if medians else group_centers
+            new_centers = update(labels, xs, ys, ws, num_clusters, centers)
+            if accelerated:
+                drift = np.abs(new_centers - centers).sum(axis=1)
+                upper += drift[labels] * (1 + slack) + slack
+                lower -= drift.max() * (1 + slack) + slack
+        centers = new_centers
+
+    with inst.phase('update'):
+        weights = group_weights(labels, ws, num_clusters)
+        corners = group_corners(labels, cxs, cys, num_clusters)
+    inst.count('iterations', iterations)
+    inst.count('distance_evaluations', evaluations)
+
+    if stats is not None:
+        stats['iterations'] = iterations
+        stats['distance_evaluations'] = evaluations
+        # a point measured against its own center, then all of them, counts
+        # k + 1 evaluations, so the total can exceed iterations*n*k
+        stats['distance_skipped'] = max(0, iterations * len(xs) * num_clusters - evaluations)
+        stats['cost'] = float(np.dot(weights, corners.sum(axis=1)))
+
+    return labels, centers, weights, corners
+
+#******************************************************************************
+# Code for CSP-aware Lloyd iterations
+#******************************************************************************
+
+def marginal_costs(xs, ys, ws, weights, corners, live):
+    """
+    (n, k) matrix of the CSP cost of adding each point to each cluster: the
+    growth of the cluster's corner paid by its weight, plus the point's own
+    weight times the grown corner's x + y. Clusters not live cost inf.
+    """
+
+    keys = corners.sum(axis=1)
+    grown = np.maximum(xs[:, None], corners[:, 0]) + np.maximum(ys[:, None], corners[:, 1])
+    cost = weights * (grown - keys) + ws[:, None] * grown
+    cost[:, ~live] = np.inf
+
+    return cost, grown > keys
+
+
+def leave_keys(labels, cxs, cys, corners):
+    """
+    x + y of every point's cluster corner once the point leaves it: the
+    corner only shrinks on a side where the point is the only one at the max
+    """
+
+    num_clusters = len(corners)
+    sides = []
+    for values, tops in ((cxs, corners[:, 0]), (cys, corners[:, 1])):
+        at_top = values == tops[labels]
+        ties = np.bincount(labels[at_top], minlength=num_clusters)
+        below = np.zeros(num_clusters)
+        np.maximum.at(below, labels[~at_top], values[~at_top])
+        alone = at_top & (ties[labels] == 1)
+        sides.append(np.where(alone, below[labels], tops[labels]))
+
+    return sides[0] + sides[1]
+
+
+def csp_lloyd(xs, ys, ws, num_clusters, num_iterations, cxs=None, cys=None, stats=None,
+              centers=None, chunk_size=CHUNK_SIZE):
+    """
+    Lloyd iterations on the CSP cost: each point moves to the cluster where
+    it adds the least cost (see marginal_costs), backing off to fewer moves
+    when moves made together do not lower it, and stopping at a single-move
+    local optimum. Input and output as for kmeans_arrays; stats gets the
+    iterations, marginal cost evaluations and final cost.
+    """
+
+    if cxs is None:
+        cxs, cys = xs, ys
+    if centers is None:
+        centers = seed_centers(xs, ys, ws, num_clusters)
+    centers = np.array(centers, dtype=float)
+    num_clusters = len(centers)
+    with inst.phase('assign'):
+        labels = nearest_centers(xs, ys, centers)
+    with inst.phase('update'):
+        weights = np.bincount(labels, weights=ws, minlength=num_clusters)
+        corners = group_corners(labels, cxs, cys, num_clusters)
+    cost = float(np.dot(weights, corners.sum(axis=1)))
+
+    evaluations = 0
+    iterations = 0
+    for dummy_i in range(num_iterations):
+        iterations += 1
+        with inst.phase('assign'):
+            new_labels = labels.copy()
+            gains = np.zeros(len(xs))
+            safe = np.zeros(len(xs), dtype=bool)
+            single = labels.copy() # best move of every point on its own
+            single_gains = np.zeros(len(xs))
+            live = weights > 0
+            # saving of a point leaving its cluster, which may shrink the corner
+            leave = (weights[labels] * corners[labels].sum(axis=1) -
+                     (weights[labels] - ws) * leave_keys(labels, cxs, cys, corners))
+            for start in range(0, len(xs), chunk_size):
+                stop = start + chunk_size
+                current = labels[start:stop]
+                marginal, grows = marginal_costs(cxs[start:stop], cys[start:stop],
+                                                 ws[start:stop], weights, corners,
+                                                 np.ones(num_clusters, dtype=bool))
+                rows = np.arange(len(marginal))
+                marginal[rows, current] = leave[start:stop]
+                single[start:stop] = marginal.argmin(axis=1)
+                single_gains[start:stop] = leave[start:stop] - marginal[rows, single[start:stop]]
+                # moves made together only go to live clusters
+                marginal[:, ~live] = np.inf
+                marginal[rows, current] = leave[start:stop]
+                best = marginal.argmin(axis=1)
+                # stay put on ties
+                stay = marginal[rows, current] <= marginal[rows, best]
+                best[stay] = current[stay]
+                new_labels[start:stop] = best
+                gains[start:stop] = marginal[rows, current] - marginal[rows, best]
+                safe[start:stop] = ~grows[rows, best]
+            evaluations += len(xs) * num_clusters
+        moved = np.nonzero(new_labels != labels)[0]
+        with inst.phase('update'):
+            # moves made together can grow corners more than they gain, or
+            # keep a corner from shrinking: back off to the half with the
+            # largest gains, then to the moves into dominating corners
+            moved = moved[np.argsort(-gains[moved], kind='stable')]
+            safe_moves = moved[safe[moved]]
+            update = None
+            while len(moved):
+                kept = labels.copy()
+                kept[moved] = new_labels[moved]
+                update = moves_update(labels, kept, moved, weights, corners, ws, cxs, cys)
+                if update[2] < cost or len(moved) <= len(safe_moves):
+                    break
+                moved = moved[:max(len(moved) // 2, len(safe_moves))]
+                if len(moved) == len(safe_moves):
+                    moved = safe_moves
+            if update is None or update[2] >= cost:
+                # the single best move lowers the cost by exactly its gain
+                point = int(np.argmax(single_gains))
+                if single_gains[point] <= 1e-12 * cost:
+                    break # a local optimum for moving any one point
+                moved = np.array([point])
+                kept = labels.copy()
+                kept[point] = single[point]
+                update = moves_update(labels, kept, moved, weights, corners, ws, cxs, cys)
+                if update[2] >= cost:
+                    break
+        labels = kept
+        weights, corners, cost = update
+
+    centers = group_centers(labels, xs, ys, ws, num_clusters, centers)
+    inst.count('iterations', iterations)
+    inst.count('marginal_evaluations', evaluations)
+
+    if stats is not None:
+        stats['iterations'] = iterations
+        stats['marginal_evaluations'] = evaluations
+        stats['cost'] = cost
+
+    return labels, centers, group_weights(labels, ws, num_clusters), corners
+
+
+def moves_update(labels, new_labels, moved, weights, corners, ws, cxs, cys):
+    """
+    (weights, corners, cost) after the moved points change from labels to
+    new_labels, touching only the moved points and the clusters they left
+    """
+
+    num_clusters = len(weights)
+    old, new = labels[moved], new_labels[moved]
+    weights = (weights - np.bincount(old, weights=ws[moved], minlength=num_clusters) +
+               np.bincount(new, weights=ws[moved], minlength=num_clusters))
+    weights[weights < 0] = 0 # rounding of emptied clusters
+    corners = np.maximum(corners, group_corners(new, cxs[moved], cys[moved], num_clusters))
+    lost = np.zeros(num_clusters, dtype=bool)
+    lost[old] = True
+    members = lost[new_labels]
+    shrunk = group_corners(new_labels[members], cxs[members], cys[members], num_clusters)
+    corners[lost] = shrunk[lost]
+
+    return weights, corners, float(np.dot(weights, corners.sum(axis=1)))
+
+#******************************************************************************
+# Multi-restart k-means
+#******************************************************************************
+
+def reassigned_cost(xs, ys, ws, cxs, cys, corners):
+    """
+    CSP cost after reassigning every point to its closest dominating
+    corner (as closestCorner does); points no corner dominates are left out
+    """
+
+    with inst.phase('reassign'):
+        labels, infeasible = DominanceIndex(corners).query(xs, ys)
+        feasible = ~infeasible
+        labels = labels[feasible]
+        weights = np.bincount(labels, weights=ws[feasible], minlength=len(corners))
+        new_corners = group_corners(labels, cxs[feasible], cys[feasible], len(corners))
+
+    return float(np.dot(weights, new_corners.sum(axis=1)))
+
+
+def kmeans_restart(xs, ys, ws, cxs, cys, num_clusters, num_iterations, init, seed,
+                   medians=False):
+    """
+    One k-means restart seeded by init with a Generator built from seed (a
+    SeedSequence). Returns (cost after reassignment, labels, centers,
+    weights, corners, iterations run).
+    """
+
+    stats = {}
+    centers = seed_centers(xs, ys, ws, num_clusters, init, np.random.default_rng(seed))
+    labels, centers, weights, corners = kmeans_arrays(xs, ys, ws, num_clusters,
+                                                      num_iterations, cxs, cys,
+                                                      stats=stats, centers=centers,
+                                                      medians=medians)
+    cost = reassigned_cost(xs, ys, ws, cxs, cys, corners)
+
+    return cost, labels, centers, weights, corners, stats['iterations']
+
+
+# per process state of the pool workers, set by _init_worker
+_worker = {}
+
+def _init_worker(xs, ys, ws, cxs, cys, num_clusters, num_iterations, medians):
+    """ Ship the points to every worker process once """
+
+    _worker['args'] = (xs, ys, ws, cxs, cys, num_clusters, num_iterations)
+    _worker['medians'] = medians
+
+
+def _worker_restart(init, seed):
+    """ Run one restart on the worker's points """
+
+    return kmeans_restart(*(_worker['args'] + (init, seed, _worker['medians'])))
+
+
+def multistart_kmeans(xs, ys, ws, num_clusters, num_iterations, restarts,
+                      cxs=None, cys=None, init='kmeans++', seed=0, workers=1,
+                      budget=None, stats=None, medians=False):
+    """
+    Run several independently seeded k-means restarts and keep the one with
+    the lowest CSP cost after reassigning the points to the closest
+    dominating corners.
+
+    Restart 0 is seeded with the heaviest points, as kmeans_arrays does, so
+    the result is never worse than a single run; the others use init
+    (see seed_indices) with generators spawned from the SeedSequence
+    of seed, so every restart is reproducible on its own. With workers > 1
+    restarts run in a process pool. budget is a wall-clock limit in
+    seconds: restarts not finished by then are dropped and their worker
+    processes terminated (at least one always completes). Ties in cost go to the lowest restart index.
+
+    Output: (labels, centers, weights, corners) of the best restart. If
+    stats is a dict it receives the restarts run, the best restart, its
+    cost and its iterations. medians runs k-medians (see kmeans_arrays).
+    """
+
+    if cxs is None:
+        cxs, cys = xs, ys
+    deadline = np.inf if budget is None else time.perf_counter() + budget
+    seeds = np.random.SeedSequence(seed).spawn(restarts)
+    tasks = [('heaviest' if idx == 0 else init, seeds[idx]) for idx in range(restarts)]
+
+    results = {}
+    if workers <= 1:
+        for idx in range(restarts):
+            if results and time.perf_counter() > deadline:
+                break
+            results[idx] = kmeans_restart(xs, ys, ws, cxs, cys, num_clusters,
+                                          num_iterations, *tasks[idx], medians=medians)
+    else:
+        pool = multiprocessing.Pool(workers, _init_worker,
+                                    (xs, ys, ws, cxs, cys, num_clusters, num_iterations, medians))
+        try:
+            pending = [pool.apply_async(_worker_restart, task) for task in tasks]
+            for future in pending:
+                future.wait(None if budget is None else max(0, deadline - time.perf_counter()))
+            while not any(future.ready() for future in pending):
+                time.sleep(0.01) # nothing finished in time, wait for the first one
+            for idx in range(restarts):
+                if pending[idx].ready():
+                    results[idx] = pending[idx].get()
+        finally:
+            # stop the restarts still running, no work outlives the budget
+            pool.terminate()
+            pool.join()
+
+    best = min(results, key=lambda idx: (results[idx][0], idx))
+    cost, labels, centers, weights, corners, iterations = results[best]
+    if stats is not None:
+        stats['restarts'] = len(results)
+        stats['best_restart'] = best
+        stats['best_cost'] = cost
+        stats['iterations'] = iterations
+
+    return labels, centers, weights, corners
+
+#******************************************************************************
+# Sweeping the number of clusters
+#******************************************************************************
+
+# one row of the curve returned by kmeans_sweep
+SWEEP = [('k', int), ('cost', float), ('reassigned_cost', float),
+         ('iterations', int), ('seconds', float)]
+
+def split_center(xs, ys, ws, labels, centers, weights, corners):
+    """
+    Centers plus one: the most expensive cluster (by its corner) with
+    members at two or more distinct positions is split by adding, as a new
+    center, its member with the largest w*d**2 (d the manhattan distance to
+    the cluster's center). The centers come back unchanged if no cluster
+    can be split.
+    """
+
+    points = np.column_stack((xs, ys))
+    low = np.full(centers.shape, np.inf)
+    high = np.full(centers.shape, -np.inf)
+    np.minimum.at(low, labels, points)
+    np.maximum.at(high, labels, points)
+    splittable = (high > low).any(axis=1)
+    if not splittable.any():
+        return centers
+    costs = np.where(splittable, weights * corners.sum(axis=1), -np.inf)
+    worst = int(np.argmax(costs))
+    members = np.flatnonzero(labels == worst)
+    dist = np.abs(xs[members] - centers[worst, 0]) + np.abs(ys[members] - centers[worst, 1])
+    point = members[np.argmax(ws[members] * dist ** 2)]
+
+    return np.vstack((centers, [[xs[point], ys[point]]]))
+
+
+def kmeans_sweep(xs, ys, ws, ks, num_iterations, cxs=None, cys=None, init='heaviest', seed=0):
+    """
+    k-means for every k in ks, reusing work between successive values.
+
+    The smallest k is seeded by init (see seed_indices); every next k
+    starts from the previous solution with its most expensive cluster
+    split (see split_center), so Lloyd's iterations only have to adjust
+    locally. Values missing between min(ks) and max(ks) are run as well to
+    keep the chain going, but are left out of the result, and so are the
+    values the points cannot reach (too few seeds, or no cluster left to
+    split): the sweep stops there.
+
+    Output: (curve, solutions). curve is a structured array with one row
+    per k (see SWEEP): CSP cost of the k-means corners, cost after
+    reassigning the points to the closest dominating corners, iterations
+    run and seconds spent on that k. solutions maps every k to its
+    (labels, centers, weights, corners).
+    """
+
+    if cxs is None:
+        cxs, cys = xs, ys
+    ks = sorted(set(ks))
+    curve = np.zeros(len(ks), dtype=SWEEP)
+    solutions = {}
+    if not ks:
+        return curve, solutions
+    centers = seed_centers(xs, ys, ws, ks[0], init, np.random.default_rng(seed))
+    row = 0
+    for k in range(ks[0], ks[-1] + 1):
+        tic = time.perf_counter()
+        if k > ks[0]:
+            centers = split_center(xs, ys, ws, labels, centers, weights, corners)
+        if len(centers) < k:
+            break
+        stats = {}
+        labels, centers, weights, corners = kmeans_arrays(xs, ys, ws, len(centers),
+                                                          num_iterations, cxs, cys,
+                                                          stats=stats, centers=centers)
+        if k == ks[row]:
+            cost = reassigned_cost(xs, ys, ws, cxs, cys, corners)
+            curve[row] = (k, stats['cost'], cost, stats['iterations'],
+                          time.perf_counter() - tic)
+            solutions[k] = (labels, centers, weights, corners)
+            row += 1
+
+    return curve[:row], solutions
@@ -0,0 +1,106 @@
+"""
+Streaming mini-batch k-means for out-of-core data: the points arrive as a
+stream of (xs, ys, ws) chunks and only per-cluster state is kept in memory.
+"""
+
+import instrumentation as inst
+import numpy as np
+from DominanceIndex import DominanceIndex
+from clustering_numpy import group_centers, group_corners, heaviest_seeds, nearest_centers
+
+
+def stream_seeds(chunks, num_clusters):
+    """
+    Centers of the num_clusters heaviest points of a stream of
+    (xs, ys, ws) chunks, keeping only num_clusters candidates in memory
+    """
+
+    xs, ys, ws = np.empty(0), np.empty(0), np.empty(0)
+    for chunk_x, chunk_y, chunk_w in chunks:
+        xs = np.concatenate((xs, chunk_x))
+        ys = np.concatenate((ys, chunk_y))
+        ws = np.concatenate((ws, chunk_w))
+        keep = np.sort(heaviest_seeds(ws, num_clusters))
+        xs, ys, ws = xs[keep], ys[keep], ws[keep]
+    seeds = heaviest_seeds(ws, num_clusters)
+
+    return np.column_stack((xs[seeds], ys[seeds]))
+
+
+def minibatch_kmeans(chunks, num_clusters, num_passes=1):
+    """
+    Mini-batch k-means over a stream of weighted points.
+
+    Input: chunks is a function returning a fresh iterator of (xs, ys, ws)
+    array chunks each time it is called (e.g. reading a file block by
+    block); it is called once for seeding and once per pass. Each chunk is
+    assigned to the nearest centers, which then move to the running
+    weighted mean of every point assigned to them so far. Memory depends on
+    the chunk size and num_clusters only.
+
+    Output: (centers, weights, corners), weights and corners as seen during
+    the last pass.
+    """
+
+    centers = stream_seeds(chunks(), num_clusters)
+    num_clusters = len(centers) # fewer seeds than clusters if points run out
+    seen = np.zeros(num_clusters) # cumulative weight behind every center
+    for dummy_pass in range(num_passes):
+        weights = np.zeros(num_clusters)
+        corners = np.zeros((num_clusters, 2))
+        for xs, ys, ws in chunks():
+            with inst.phase('assign'):
+                labels = nearest_centers(xs, ys, centers)
+            inst.count('distance_evaluations', len(xs) * num_clusters)
+            batch = np.bincount(labels, weights=ws, minlength=num_clusters)
+            moved = batch > 0
+            seen[moved] += batch[moved]
+            # move each center towards the batch mean, by the batch's share
+            # of all the weight the center has absorbed
+            batch_centers = group_centers(labels, xs, ys, ws, num_clusters, centers)
+            share = batch[moved] / seen[moved]
+            centers[moved] += share[:, None] * (batch_centers[moved] - centers[moved])
+            weights += batch
+            corners = np.maximum(corners, group_corners(labels, xs, ys, num_clusters))
+
+    return centers, weights, corners
+
+
+def stream_reassign(chunks, corners, sink=None):
+    """
+    Streaming closestCorner: assign every point of a stream of (xs, ys, ws)
+    chunks to its closest dominating corner, accumulating only per-cluster
+    aggregates. sink, if given, is called as sink(xs, ys, ws, labels) for
+    every chunk (labels are -1 for points no corner dominates).
+
+    Output: (centers, weights, corners, count), where corners are the
+    upper right corners of the reassigned clusters and count is the number
+    of points that were clustered.
+    """
+
+    index = DominanceIndex(corners)
+    num_clusters = len(index)
+    weights = np.zeros(num_clusters)
+    sum_x = np.zeros(num_clusters)
+    sum_y = np.zeros(num_clusters)
+    new_corners = np.zeros((num_clusters, 2))
+    count = 0
+    for xs, ys, ws in chunks:
+        with inst.phase('reassign'):
+            labels, infeasible = index.query(xs, ys)
+        if sink is not None:
+            sink(xs, ys, ws, labels)
+        feasible = ~infeasible
+        fl, fx, fy, fw = labels[feasible], xs[feasible], ys[feasible], ws[feasible]
+        weights += np.bincount(fl, weights=fw, minlength=num_clusters)
+        sum_x += np.bincount(fl, weights=fw*fx, minlength=num_clusters)
+        sum_y += np.bincount(fl, weights=fw*fy, minlength=num_clusters)
+        new_corners = np.maximum(new_corners, group_corners(fl, fx, fy, num_clusters))
+        count += len(fl)
+
+    centers = np.zeros((num_clusters, 2))
+    nonempty = weights > 0
+    centers[nonempty, 0] = sum_x[nonempty] / weights[nonempty]
+    centers[nonempty, 1] = sum_y[nonempty] / weights[nonempty]
+
+    return centers, weights, new_corners, count
@@ -0,0 +1,315 @@
+"""
+Exact CSP solvers over a set of potential container points: a branch and
+bound search, its parallel split over worker processes and the k-means
+warm start that seeds its incumbent.
+"""
+
+from Cluster import Cluster
+from clustering_algorithms import closestCorner, kmeans_clustering
+from DominanceIndex import DominanceIndex
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+import instrumentation as inst
+import multiprocessing
+import numpy as np
+import time
+
+# largest number of point/candidate pairs held at once in a boolean matrix
+BLOCK_SIZE = 1 << 20
+
+#******************************************************************************
+# Branch and bound search
+#******************************************************************************
+
+def cornerCost(data, corners):
+    """
+    Cost sum(w*(x + y)) of the closest dominating corner of every point,
+    inf if some point is not dominated by any corner
+    """
+
+    xs = np.array([point[1] for point in data])
+    ys = np.array([point[2] for point in data])
+    ws = np.array([point[3] for point in data], dtype=float)
+    labels, infeasible = DominanceIndex(corners).query(xs, ys)
+    if infeasible.any():
+        return float('inf')
+    keys = np.asarray(corners, dtype=float).sum(axis=1)
+
+    return float(np.dot(ws, keys[labels]))
+
+
+def lastDominating(xs, ys, cand):
+    """
+    For every point, the largest index of a candidate dominating it (-1 if
+    there is none)
+    """
+
+    last = np.full(len(xs), -1, dtype=np.intp)
+    rows = max(1, BLOCK_SIZE // max(1, len(cand)))
+    for start in range(0, len(xs), rows):
+        dom = ((cand[::-1, 0] >= xs[start:start + rows, None]) &
+               (cand[::-1, 1] >= ys[start:start + rows, None]))
+        found = dom.any(axis=1)
+        last[start:start + rows] = np.where(found, len(cand) - 1 - dom.argmax(axis=1), -1)
+
+    return last
+
+
+class _Search:
+    """
+    State of one branch and bound run: the points, the candidates sorted by
+    x + y, the incumbent and the node counters
+    """
+
+    def __init__(self, data, potential_container, k, incumbent, shared=None, deadline=None):
+        self.xs = np.array([point[1] for point in data])
+        self.ys = np.array([point[2] for point in data])
+        self.ws = np.array([point[3] for point in data], dtype=float)
+        self.own = self.xs + self.ys # cost of a point sitting on its corner
+        cand = np.unique(np.asarray(potential_container, dtype=float).reshape(-1, 2), axis=0)
+        self.keys = cand.sum(axis=1)
+        order = np.argsort(self.keys, kind='stable')
+        self.cand, self.keys = cand[order], self.keys[order]
+        self.k = k
+        self.last = lastDominating(self.xs, self.ys, self.cand)
+        self.warm = incumbent
+        self.shared = shared # best cost over all worker processes, if any
+        self.deadline = deadline # time.monotonic() at which to give up, if any
+        self.expired = False
+        self.best = (float('inf'), [])
+        self.nodes = 0
+        self.pruned = 0
+
+    def pruneAt(self, lower):
+        """ Whether a subtree with this lower bound can be discarded """
+        if self.shared is not None and lower > self.shared.value:
+            return True
+        return lower > self.warm or lower >= self.best[0]
+
+    def record(self, cost, chosen):
+        """ Keep a complete solution if it improves on the best one """
+        if cost < self.best[0]:
+            self.best = (cost, [tuple(self.cand[idx]) for idx in chosen])
+            if self.shared is not None:
+                with self.shared.get_lock():
+                    if cost < self.shared.value:
+                        self.shared.value = cost
+
+    def outOfTime(self):
+        """ Whether the deadline has passed; the search then unwinds """
+        if self.deadline is not None and not self.expired:
+            self.expired = time.monotonic() > self.deadline
+        return self.expired
+
+    def lowerBound(self, best, idx):
+        """
+        Lower bound for any completion that only adds candidates from idx on:
+        their x + y is at least keys[idx]
+        """
+        return np.dot(self.ws, np.minimum(best, np.maximum(self.own, self.keys[idx])))
+
+    def search(self, chosen, start, best, stop=None):
+        """
+        Depth first over candidates start, start + 1, ... (up to stop) given
+        the chosen ones and the per-point best corner cost (inf when
+        uncovered). The children of a node are screened in blocks of
+        candidates.
+        """
+        if self.outOfTime():
+            return
+        uncovered = np.isinf(best)
+        slots = self.k - len(chosen) - 1 # left after the next choice
+        if stop is None:
+            stop = len(self.cand)
+        if slots == 0:
+            self.searchLast(chosen, start, best, uncovered, stop)
+            return
+        # the last candidate that can still cover every uncovered point
+        if uncovered.any():
+            stop = min(stop, self.last[uncovered].min() + 1)
+        rows = max(1, BLOCK_SIZE // max(1, len(self.xs)))
+        for lo in range(start, stop, rows):
+            hi = min(lo + rows, stop)
+            cand, keys = self.cand[lo:hi], self.keys[lo:hi]
+            # no completion from here on pays less than keys[idx] per corner
+            capped = np.maximum(self.own, keys[:, None])
+            bounds = np.minimum(best, capped).dot(self.ws)
+            dom = (cand[:, 0, None] >= self.xs) & (cand[:, 1, None] >= self.ys)
+            better = dom & (keys[:, None] < best)
+            useful = better.any(axis=1) # the corner would serve somebody
+            child = np.where(better, keys[:, None], best)
+            left = uncovered & ~dom
+            lower = np.minimum(child, capped)
+            if slots == 1:
+                # a single corner has to dominate every point still left
+                top = (np.where(left, self.xs, -np.inf).max(axis=1) +
+                       np.where(left, self.ys, -np.inf).max(axis=1))
+                lower = np.where(left, np.maximum(keys, top)[:, None], lower)
+            lowers = lower.dot(self.ws)
+            complete = ~left.any(axis=1)
+            for row in range(hi - lo):
+                self.nodes += 1
+                if self.pruneAt(bounds[row]):
+                    # keys only grow from here on, so does the bound
+                    self.pruned += stop - lo - row
+                    return
+                if not useful[row]:
+                    continue
+                if complete[row]:
+                    self.record(np.dot(self.ws, child[row]), chosen + [lo + row])
+                if self.pruneAt(lowers[row]):
+                    self.pruned += 1
+                    continue
+                self.search(chosen + [lo + row], lo + row + 1, child[row])
+
+    def searchLast(self, chosen, start, best, uncovered, stop):
+        """ Evaluate every choice of the last corner in blocks of candidates """
+        if uncovered.any():
+            # the last corner must dominate the uncovered points' max corner
+            top_x, top_y = self.xs[uncovered].max(), self.ys[uncovered].max()
+            start = max(start, int(np.searchsorted(self.keys, top_x + top_y)))
+            stop = min(stop, self.last[uncovered].min() + 1)
+        rows = max(1, BLOCK_SIZE // max(1, len(self.xs)))
+        for lo in range(start, stop, rows):
+            if self.outOfTime():
+                return
+            if self.pruneAt(self.lowerBound(best, lo)):
+                self.pruned += stop - lo
+                return
+            hi = min(lo + rows, stop)
+            cand, keys = self.cand[lo:hi], self.keys[lo:hi]
+            self.nodes += hi - lo
+            dom = (cand[:, 0, None] >= self.xs) & (cand[:, 1, None] >= self.ys)
+            child = np.where(dom, np.minimum(keys[:, None], best), best)
+            feasible = np.isfinite(child).all(axis=1)
+            if not feasible.any():
+                continue
+            costs = np.where(np.isfinite(child), child, 0).dot(self.ws)
+            costs[~feasible] = float('inf')
+            pick = int(costs.argmin())
+            self.record(costs[pick], chosen + [lo + pick])
+
+
+def branchAndBound(data, potential_container, k, incumbent=float('inf'), workers=1,
+                   deadline=None):
+    """
+    Exact CSP solver over the potential container points.
+
+    Candidates are tried in increasing order of x + y, a subtree is pruned
+    when the bound sum(w*max(x + y, next key)) exceeds the incumbent, and a
+    branch stops as soon as a point can no longer be dominated. incumbent
+    is the cost of a known solution (e.g. a k-means warm start). With
+    workers > 1 the first corner's choices are split across processes. With
+    a deadline (a time.monotonic() value) the search stops when it passes,
+    keeping the best solution found so far.
+
+    Returns (best cost, best corners, nodes visited, candidates pruned,
+    expired); corners is empty if no solution beats the incumbent, and
+    expired is True if the deadline cut the search short.
+    """
+
+    search = _Search(data, potential_container, k, incumbent, deadline=deadline)
+    if len(search.cand) == 0 or (search.last < 0).any(): # dominance pre-check
+        return float('inf'), [], 0, 0, False
+    with inst.phase('search'):
+        if workers > 1:
+            result = parallelSearch(data, search.cand, k, incumbent, workers, 'bnb', deadline)
+        else:
+            search.search([], 0, np.full(len(search.xs), float('inf')))
+            result = (search.best[0], search.best[1], search.nodes, search.pruned,
+                      search.expired)
+    inst.count('nodes', result[2])
+    inst.count('pruned', result[3])
+
+    return result
+
+#******************************************************************************
+# Parallel search
+#******************************************************************************
+
+# per process state of the pool workers, set by _initWorker
+_worker = {}
+
+def _initWorker(data, potential_container, k, incumbent, shared, method, deadline):
+    """ Build the search state once in every worker process """
+
+    if method == 'naive':
+        _worker['singletons'] = [Cluster(set([x[0]]), x[1], x[2], x[3], (x[1], x[2])) for x in data]
+        _worker['corners'] = [tuple(corner) for corner in potential_container.tolist()]
+        _worker['k'] = k
+    else:
+        _worker['search'] = _Search(data, potential_container, k, incumbent, shared, deadline)
+
+
+def _bnbRange(lo, hi):
+    """ Branch and bound over the solutions whose first corner is in lo..hi-1 """
+
+    search = _worker['search']
+    search.best = (float('inf'), [])
+    search.nodes = search.pruned = 0
+    search.search([], lo, np.full(len(search.xs), float('inf')), hi)
+
+    return search.best[0], search.best[1], search.nodes, search.pruned, search.expired
+
+
+def _naiveRange(lo, hi):
+    """ Enumerate the combinations whose first corner is in lo..hi-1 """
+
+    singletons, corners, k = _worker['singletons'], _worker['corners'], _worker['k']
+    best = (float('inf'), [])
+    i = 0
+    for first in range(lo, hi):
+        for rest in combinations(corners[first + 1:], k - 1):
+            i += 1
+            combination = (corners[first],) + rest
+            cluster_list, count = closestCorner(singletons, combination)
+            if count == len(singletons):
+                cost = sum([cluster.cost() for cluster in cluster_list])
+                if cost < best[0]:
+                    best = cost, list(combination)
+
+    return best[0], best[1], i, 0, False
+
+
+def parallelSearch(data, potential_container, k, incumbent, workers, method, deadline=None):
+    """
+    Split the search by its first corner into ranges of candidates handled
+    by a pool of worker processes. Workers share the best cost found so
+    far, and the result is merged as the serial run would find it: lowest
+    cost, then earliest range.
+
+    Returns (best cost, best corners, nodes visited, candidates pruned,
+    expired)
+    """
+
+    cand = np.asarray(potential_container, dtype=float).reshape(-1, 2)
+    run = _naiveRange if method == 'naive' else _bnbRange
+    step = max(1, len(cand) // (32*workers))
+    ranges = [(lo, min(lo + step, len(cand))) for lo in range(0, len(cand), step)]
+
+    shared = multiprocessing.Value('d', incumbent)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_initWorker,
+                             initargs=(data, cand, k, incumbent, shared, method, deadline)) as pool:
+        results = list(pool.map(run, *zip(*ranges)))
+
+    best = (float('inf'), [])
+    for cost, corners, dummy_nodes, dummy_pruned, dummy_expired in results:
+        if cost < best[0]:
+            best = (cost, corners)
+
+    return (best[0], best[1], sum([result[2] for result in results]),
+            sum([result[3] for result in results]), any([result[4] for result in results]))
+
+
+def warmStart(data, singletons, k, iterations):
+    """
+    Incumbent cost and corners from a k-means solution reassigned to the
+    closest dominating corners
+    """
+
+    cluster_list = kmeans_clustering(singletons, k, iterations)
+    corners = [cluster.corner() for cluster in cluster_list]
+    cluster_list = closestCorner(singletons, corners)[0]
+    corners = [cluster.corner() for cluster in cluster_list if cluster.fips_codes()]
+
+    return cornerCost(data, corners), corners
@@ -0,0 +1,215 @@
+"""
+Lightweight instrumentation for the solvers: named phase timers, event
+counters and optional cProfile / tracemalloc capture.
+
+Instrumentation is off by default. While off, phase() hands back a shared
+do-nothing context manager and count() returns right away, so the hooks
+cost one function call each and can stay in the code. Hooks sit at the
+granularity of whole passes (an assignment step, a reassignment, a
+search), never inside per-point loops.
+
+    import instrumentation as inst
+    inst.enable()
+    with inst.phase('assign'):
+        ...
+    inst.count('distance_evaluations', n)
+    print(inst.report())
+
+Counters and timers are per process: work done in pool workers is not
+included.
+"""
+
+import cProfile
+import io
+import json
+import pstats
+import sys
+import time
+import tracemalloc
+
+# names of the phases the solvers report
+PHASES = ['load', 'seed', 'assign', 'update', 'merge', 'candidates', 'transform', 'search',
+          'reassign', 'evaluate', 'plot']
+
+_state = {'enabled': False, 'profiler': None, 'memory': False}
+_timers = {}
+_counters = {}
+
+
+class _Phase:
+    """
+    Context manager adding its elapsed time to a named timer
+    """
+
+    __slots__ = ('_name', '_start')
+
+    def __init__(self, name):
+        self._name = name
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        timer = _timers.setdefault(self._name, [0.0, 0])
+        timer[0] += time.perf_counter() - self._start
+        timer[1] += 1
+        return False
+
+
+class _NoPhase:
+    """
+    Do-nothing context manager used while instrumentation is off
+    """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_PHASE = _NoPhase()
+
+
+def enable(profile = False, memory = False):
+    """
+    Start collecting phase timings and counters, and optionally a cProfile
+    profile and the tracemalloc peak of everything run until disable
+    """
+    reset()
+    _state['enabled'] = True
+    if profile:
+        _state['profiler'] = cProfile.Profile()
+        _state['profiler'].enable()
+    if memory:
+        _state['memory'] = True
+        tracemalloc.start()
+
+
+def disable():
+    """
+    Stop collecting; the data gathered so far stays available to report
+    """
+    _state['enabled'] = False
+    if _state['profiler'] is not None:
+        _state['profiler'].disable()
+    if _state['memory'] and tracemalloc.is_tracing():
+        _state['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+
+def enabled():
+    """
+    Whether instrumentation is collecting
+    """
+    return _state['enabled']
+
+
+def reset():
+    """
+    Drop all timings, counters and captures
+    """
+    _timers.clear()
+    _counters.clear()
+    _state.update(profiler = None, memory = False)
+    _state.pop('peak_bytes', None)
+
+
+def phase(name):
+    """
+    Context manager timing a named phase of a run
+    """
+    if _state['enabled']:
+        return _Phase(name)
+    return _NO_PHASE
+
+
+def count(name, value = 1):
+    """
+    Add value to a named counter
+    """
+    if _state['enabled']:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def report(top = 20):
+    """
+    Dictionary of the collected data: phases (seconds and calls per phase),
+    counters, and when captured the peak traced memory in bytes and the
+    top cProfile entries by cumulative time
+    """
+    data = {'phases': dict((name, {'seconds': timer[0], 'calls': timer[1]})
+                           for name, timer in _timers.items()),
+            'counters': dict((name, int(value) if value == int(value) else value)
+                             for name, value in _counters.items())}
+    if _state['memory']:
+        if tracemalloc.is_tracing():
+            data['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        else:
+            data['peak_bytes'] = _state.get('peak_bytes')
+    if _state['profiler'] is not None:
+        stream = io.StringIO()
+        stats = pstats.Stats(_state['profiler'], stream = stream)
+        stats.sort_stats('cumulative').print_stats(top)
+        data['profile'] = stream.getvalue()
+    return data
+
+
+def format_report(data):
+    """
+    Plain text rendering of report()
+    """
+    lines = ["%-12s %12s %8s" % ('phase', 'seconds', 'calls')]
+    for name, timer in sorted(data['phases'].items(), key = lambda item: -item[1]['seconds']):
+        lines.append("%-12s %12.6f %8d" % (name, timer['seconds'], timer['calls']))
+    for name, value in sorted(data['counters'].items()):
+        lines.append("%-24s %s" % (name, value))
+    if data.get('peak_bytes') is not None:
+        lines.append("%-24s %.1fMB" % ('peak memory', data['peak_bytes'] / 2.0 ** 20))
+    if 'profile' in data:
+        lines.append(data['profile'])
+    return '\n'.join(lines)
+
+
+def emit(fmt, stream = None):
+    """
+    Write report() to stream (default stdout) as 'json' or 'text'
+    """
+    stream = stream or sys.stdout
+    data = report()
+    if fmt == 'json':
+        stream.write(json.dumps(data, sort_keys = True) + '\n')
+    else:
+        stream.write(format_report(data) + '\n')
+
+
+def add_arguments(parser):
+    """
+    Add the --stats, --profile and --trace-memory options to an argparse
+    parser
+    """
+    parser.add_argument('--stats', choices = ['text', 'json'], default = None,
+                        help = 'report phase timings and counters at the end')
+    parser.add_argument('--profile', action = 'store_true',
+                        help = 'with --stats, include a cProfile summary')
+    parser.add_argument('--trace-memory', action = 'store_true',
+                        help = 'with --stats, include the tracemalloc peak')
+
+
+def run(main, args):
+    """
+    Call main(args) with instrumentation enabled as args asks (see
+    add_arguments), emitting the report at the end
+    """
+    if args.stats is None:
+        return main(args)
+    enable(args.profile, args.trace_memory)
+    try:
+        return main(args)
+    finally:
+        disable()
+        emit(args.stats)